@@ -0,0 +1,58 @@
+from dependency import queue_full, token_email, too_many_requests
+from fastapi import HTTPException, status
+from fastapi.responses import JSONResponse
+from redis.asyncio import Redis
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+
+UPLOAD_SCOPES = {"/images/": "upload", "/images/batch/": "batch"}
+
+
+async def admit(redis: Redis, scope: Scope) -> HTTPException | None:
+    """
+    The error an upload is refused with before its body is read: invalid
+    credentials, the user's rate limit, then a full conversion queue
+    """
+    headers = dict(scope["headers"])
+    authorization = headers.get(b"authorization", b"").decode()
+    scheme, _, token = authorization.partition(" ")
+    email = token_email(token) if scheme.lower() == "bearer" else None
+    if email is None:
+        return HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    error = await too_many_requests(redis, UPLOAD_SCOPES[scope["path"]], email)
+    if error is None:
+        error = await queue_full(redis)
+    return error
+
+
+class AdmissionMiddleware:
+    """
+    Pure ASGI, so that a throttled or shed client is answered before it
+    has sent its upload instead of after the form is spooled
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if (
+            scope["type"] != "http"
+            or scope["method"] != "POST"
+            or scope["path"] not in UPLOAD_SCOPES
+        ):
+            await self.app(scope, receive, send)
+            return
+        error = await admit(scope["app"].state.redis, scope)
+        if error is None:
+            await self.app(scope, receive, send)
+            return
+        response = JSONResponse(
+            {"detail": error.detail},
+            status_code=error.status_code,
+            headers=error.headers,
+        )
+        await response(scope, receive, send)
@@ -1,22 +1,57 @@
+import asyncio
 import json
+import logging
 import os
+from dataclasses import asdict
 from datetime import timedelta
+from functools import partial
 from pathlib import Path
-from typing import Annotated
-from uuid import uuid4
+from shutil import rmtree
+from typing import Annotated, Any, Sequence
+from uuid import UUID, uuid4
 
+import content_index
 import crud
 import fastapi as fa
+import jobs
 import models
 import schemas
-import sqlalchemy as sa
-from celery_app import image_convertor, redis_app
-from dependency import AsyncSessionDepency, GetCurrentUser, get_current_user
-from security import authenticate_user, create_access_token, get_password_hash
+import tag_catalog
+from celery_app import (
+    convert_batch,
+    convert_image,
+    get_variants,
+    render_variant,
+)
+from dependency import (
+    AsyncSessionDepency,
+    GetCurrentUser,
+    RedisDepency,
+    TagCatalogDepency,
+    get_current_user,
+    rate_limit,
+)
+from security import (
+    async_get_password_hash,
+    authenticate_user,
+    create_access_token,
+)
 from settings import config
-from utils import write_file
+from sqlalchemy.engine import RowMapping
+from starlette.concurrency import run_in_threadpool
+from static import MediaFileResponse
+from utils import (
+    check_format,
+    check_size,
+    decode_cursor,
+    encode_cursor,
+    image_pixels,
+    write_file,
+)
 
 
+logger = logging.getLogger(__name__)
+
 user_router = fa.APIRouter(prefix="/users", tags=["users"])
 image_router = fa.APIRouter(prefix="/images", tags=["images"])
 tags_router = fa.APIRouter(prefix="/tags", tags=["tags"])
@@ -46,7 +81,7 @@ async def create_user(
     session: AsyncSessionDepency, user_data: schemas.CreateUser
 ):
     data = user_data.model_dump()
-    data["password"] = get_password_hash(data["password"])
+    data["password"] = await async_get_password_hash(data["password"])
     result = await crud.create_or_update_user(
         session, models.User, data, crud.create_item
     )
@@ -59,101 +94,461 @@ async def create_user(
     status_code=fa.status.HTTP_201_CREATED,
 )
 async def create_tags(
-    session: AsyncSessionDepency, tags_data: schemas.TagsCreate
+    session: AsyncSessionDepency,
+    redis: RedisDepency,
+    tags_data: schemas.TagsCreate,
 ):
     data = tags_data.model_dump()
-    return await crud.create_item(session, models.Tag, data)
+    tag: models.Tag = await crud.create_item(session, models.Tag, data)
+    await tag_catalog.bump(redis)
+    return tag
+
+
+async def dump_images(
+    rows: Sequence[RowMapping], catalog: tag_catalog.TagCatalog
+) -> list[dict[str, Any]]:
+    """
+    Attach tags from the catalog and validate the rows in one pass, the
+    result is rendered by orjson
+    """
+    await catalog.known({tag_id for row in rows for tag_id in row["tag_ids"]})
+    images = schemas.images_adapter.validate_python(
+        [{**row, "tags": catalog.resolve(row["tag_ids"])} for row in rows]
+    )
+    return schemas.images_adapter.dump_python(images)
+
+
+async def get_images_page(
+    session: AsyncSessionDepency,
+    catalog: tag_catalog.TagCatalog,
+    pagination: schemas.Pagination,
+    **filters: Any,
+) -> fa.responses.ORJSONResponse:
+    cursor = None
+    if pagination.cursor is not None:
+        cursor = decode_cursor(pagination.cursor)
+    images = await crud.get_images_page(
+        session, pagination.limit + 1, cursor, **filters
+    )
+    next_cursor = None
+    if len(images) > pagination.limit:
+        images = images[: pagination.limit]
+        next_cursor = encode_cursor(images[-1]["data"], images[-1]["id"])
+    return fa.responses.ORJSONResponse(
+        {
+            "items": await dump_images(images, catalog),
+            "next_cursor": next_cursor,
+        }
+    )
 
 
 @image_router.get(
     "/",
-    response_model=list[schemas.ImageResponse],
+    response_model=schemas.ImagePage,
+    response_class=fa.responses.ORJSONResponse,
     dependencies=[fa.Depends(get_current_user)],
 )
-async def get_images(session: AsyncSessionDepency):
-    return await session.scalars(sa.select(models.Image))
+async def get_images(
+    session: AsyncSessionDepency,
+    catalog: TagCatalogDepency,
+    filters: Annotated[schemas.ImageFilter, fa.Depends()],
+    pagination: Annotated[schemas.Pagination, fa.Depends()],
+):
+    return await get_images_page(
+        session, catalog, pagination, **asdict(filters)
+    )
 
 
-@image_router.post("/", response_class=fa.responses.JSONResponse)
-async def create_image(
-    image_data: Annotated[schemas.ImageCreate, fa.Depends()],
-    image: Annotated[fa.UploadFile, fa.File()],
-    user: GetCurrentUser,
+@image_router.get(
+    "/search",
+    response_model=schemas.ImagePage,
+    response_class=fa.responses.ORJSONResponse,
+    dependencies=[fa.Depends(get_current_user)],
+)
+async def search_images(
+    session: AsyncSessionDepency,
+    catalog: TagCatalogDepency,
+    search: Annotated[schemas.ImageSearch, fa.Depends()],
+    pagination: Annotated[schemas.Pagination, fa.Depends()],
 ):
+    tags = [int(tag) for tag in search.tags.split(",")]
+    return await get_images_page(
+        session, catalog, pagination, tags=tags, match=search.match
+    )
+
+
+async def store_image(  # pylint:disable=R0913,R0914
+    image: fa.UploadFile,
+    image_data: schemas.ImageCreate,
+    session: AsyncSessionDepency,
+    redis: RedisDepency,
+    user: GetCurrentUser,
+    *,
+    batch_id: str | None = None,
+) -> tuple[str, dict[str, Any] | None]:
+    """
+    Save the upload (or link the stored copy of the same content) and
+    register its job. Returns the job id and the data to convert, None
+    when every variant was reused
+    """
     file_name = Path(image.filename).stem  # type:ignore[arg-type]
     identifier = str(uuid4())
     media_dir_image = config.MEDIA_DIR / identifier
     media_dir_image.mkdir()
-    media_image = write_file(
-        image.filename,  # type:ignore[arg-type]
-        await image.read(),
-        media_dir_image,
-    )
-    dict_ = image_data.__dict__
+    try:
+        written, digest = await run_in_threadpool(
+            write_file,
+            image.filename,  # type:ignore[arg-type]
+            image.file,
+            media_dir_image,
+            config.MAX_UPLOAD_SIZE,
+            config.UPLOAD_CHUNK_SIZE,
+        )
+    except fa.HTTPException:
+        await run_in_threadpool(rmtree, media_dir_image)
+        raise
+    dict_ = asdict(image_data)
     dict_.update(
         {
             "media_dir": str(media_dir_image),
-            "media_image": media_image,
             "file_name": file_name,
             "user_email": user.email,
             "uuid": identifier,
+            "digest": digest,
         }
     )
-    image_convertor.delay(json.dumps(dict_))
+    variants = dict_["variants"] = get_variants(dict_)
+
+    index = await redis.hgetall(  # type: ignore[misc]
+        content_index.key(digest)
+    )
+    linked, images = await run_in_threadpool(
+        content_index.link_existing, index, dict_
+    )
+    if linked is None:
+        media_image = written
+        await redis.hset(  # type: ignore[misc]
+            content_index.key(digest), content_index.ORIGINAL, media_image
+        )
+    else:
+        # the same content is stored already, keep only the link to it
+        await run_in_threadpool(os.unlink, written)
+        media_image = linked
+    dict_["media_image"] = media_image
+    await redis.set(content_index.original_key(identifier), media_image)
+
+    await crud.create_images(session, images, dict_["tags"])
+    if dict_["variants"]:
+        dict_["pixels"] = await run_in_threadpool(image_pixels, media_image)
+    reused = [v for v in variants if v not in dict_["variants"]]
+    await jobs.create(
+        redis,
+        identifier,
+        user.email,
+        dict_["variants"],
+        reused,
+        batch_id=batch_id,
+        # only the originals still to convert count as pending work
+        size=(image.size or 0) if dict_["variants"] else 0,
+    )
+    if dict_["variants"]:
+        return identifier, dict_
+    await redis.set(user.email, identifier)
+    return identifier, None
+
+
+@image_router.post(
+    "/",
+    response_class=fa.responses.JSONResponse,
+)
+async def create_image(
+    image_data: Annotated[schemas.ImageCreate, fa.Depends()],
+    image: Annotated[fa.UploadFile, fa.File()],
+    session: AsyncSessionDepency,
+    redis: RedisDepency,
+    user: GetCurrentUser,
+):
+    check_format(image_data.format)
+    if image.size is not None:
+        check_size(image.size, config.MAX_UPLOAD_SIZE)
+    job_id, dict_ = await store_image(image, image_data, session, redis, user)
+    if dict_ is not None:
+        convert_image(dict_)
     return fa.responses.JSONResponse(
-        content="Create image", status_code=fa.status.HTTP_201_CREATED
+        content={"detail": "Create image", "job_id": job_id},
+        status_code=fa.status.HTTP_201_CREATED,
     )
 
 
-@image_router.get("/result/", response_model=list[schemas.ImageResponse])
-async def get_result(session: AsyncSessionDepency, user: GetCurrentUser):
-    identifier = redis_app.get(user.email)
-    stmt = sa.select(models.Image).where(models.Image.uuid == identifier)
-    images = await session.scalars(stmt)
-    return images
+@image_router.post(
+    "/batch/",
+    response_class=fa.responses.JSONResponse,
+)
+async def create_images_batch(
+    image_data: Annotated[schemas.ImageCreate, fa.Depends()],
+    images: Annotated[list[fa.UploadFile], fa.File()],
+    session: AsyncSessionDepency,
+    redis: RedisDepency,
+    user: GetCurrentUser,
+):
+    """
+    Many images with the same resolutions and tags. They are converted by
+    chunks of BATCH_CHUNK_SIZE images per task. An image that can't be
+    stored is failed in the batch and listed, the others go on
+    """
+    if len(images) > config.BATCH_MAX_FILES:
+        raise fa.HTTPException(
+            status_code=fa.status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"More than {config.BATCH_MAX_FILES} files",
+        )
+    check_format(image_data.format)
+    for image in images:
+        if image.size is not None:
+            check_size(image.size, config.MAX_UPLOAD_SIZE)
+    batch_id = str(uuid4())
+    await jobs.create_batch(redis, batch_id, user.email, len(images))
+    job_ids, pending, failed = [], [], []
+    try:
+        for image in images:
+            try:
+                job_id, dict_ = await store_image(
+                    image, image_data, session, redis, user, batch_id=batch_id
+                )
+            except fa.HTTPException as error:
+                failed.append({"file": image.filename, "detail": error.detail})
+                continue
+            except Exception:  # pylint:disable=W0718
+                logger.exception("Storing %s failed", image.filename)
+                await session.rollback()
+                failed.append(
+                    {"file": image.filename, "detail": "Image not stored"}
+                )
+                continue
+            job_ids.append(job_id)
+            if dict_ is not None:
+                pending.append(dict_)
+    finally:
+        # the stored ones are converted anyway, the rest can't be
+        convert_batch(pending)
+        if len(job_ids) < len(images):
+            await jobs.fail_in_batch(
+                redis, batch_id, len(images) - len(job_ids)
+            )
+    return fa.responses.JSONResponse(
+        content={
+            "detail": "Create images",
+            "batch_id": batch_id,
+            "job_ids": job_ids,
+            "failed": failed,
+        },
+        status_code=fa.status.HTTP_201_CREATED,
+    )
+
+
+@image_router.get("/batches/{batch_id}", response_model=schemas.BatchResponse)
+async def get_batch_status(
+    batch_id: UUID, redis: RedisDepency, user: GetCurrentUser
+):
+    batch = await jobs.get_batch(redis, str(batch_id))
+    if batch is None or batch.pop("owner") != user.email:
+        raise fa.HTTPException(
+            status_code=fa.status.HTTP_404_NOT_FOUND, detail="Batch not found"
+        )
+    return batch
+
+
+async def get_job(
+    job_id: UUID, redis: RedisDepency, user: GetCurrentUser
+) -> dict[str, Any]:
+    job = await jobs.get(redis, str(job_id))
+    if job is None or job.pop("owner") != user.email:
+        raise fa.HTTPException(
+            status_code=fa.status.HTTP_404_NOT_FOUND, detail="Job not found"
+        )
+    return job
+
+
+@image_router.get("/jobs/{job_id}", response_model=schemas.JobResponse)
+async def get_job_status(job: Annotated[dict[str, Any], fa.Depends(get_job)]):
+    return job
+
+
+@image_router.get("/jobs/{job_id}/events")
+async def get_job_events(
+    job: Annotated[dict[str, Any], fa.Depends(get_job)],
+    request: fa.Request,
+    redis: RedisDepency,
+):
+    """
+    Server-Sent Events with the job status, the stream ends once the job
+    is done or failed
+    """
+
+    async def events():
+        async with request.app.state.job_events.subscribe(
+            job["job_id"]
+        ) as queue:
+            # read again after subscribing to not miss an update
+            snapshot = await jobs.get(redis, job["job_id"]) or job
+            snapshot.pop("owner", None)
+            yield f"data: {json.dumps(snapshot)}\n\n"
+            while snapshot["status"] not in jobs.FINAL:
+                try:
+                    data = await asyncio.wait_for(
+                        queue.get(), config.JOB_EVENTS_PING
+                    )
+                except TimeoutError:
+                    # a job lost to a killed worker is only failed by a read
+                    snapshot = await jobs.get(redis, job["job_id"]) or job
+                    snapshot.pop("owner", None)
+                    if snapshot["status"] in jobs.FINAL:
+                        yield f"data: {json.dumps(snapshot)}\n\n"
+                    else:
+                        yield ": ping\n\n"
+                    continue
+                snapshot = json.loads(data)
+                yield f"data: {data}\n\n"
+
+    return fa.responses.StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
+@image_router.get(
+    "/result/",
+    response_model=list[schemas.ImageResponse],
+    response_class=fa.responses.ORJSONResponse,
+)
+async def get_result(
+    session: AsyncSessionDepency,
+    redis: RedisDepency,
+    catalog: TagCatalogDepency,
+    user: GetCurrentUser,
+):
+    identifier = await redis.get(user.email)
+    images = await crud.get_images_by_uuid(session, identifier)
+    return fa.responses.ORJSONResponse(await dump_images(images, catalog))
 
 
-@image_router.patch("/{image_id}/", response_model=schemas.ImageResponse)
+@image_router.get(
+    "/{identifier}/render",
+    response_class=MediaFileResponse,
+    dependencies=[fa.Depends(rate_limit("render"))],
+)
+async def render_image(
+    identifier: UUID,
+    params: Annotated[schemas.ImageRender, fa.Depends()],
+    request: fa.Request,
+    redis: RedisDepency,
+):
+    not_found = fa.HTTPException(
+        status_code=fa.status.HTTP_404_NOT_FOUND, detail="Image not found"
+    )
+    original = await redis.get(content_index.original_key(str(identifier)))
+    if original is None:
+        raise not_found
+    mode = params.mode or "original"
+    name = f"{identifier}_{params.w}x{params.h}_{mode}{Path(original).suffix}"
+    render = partial(
+        render_variant, original, (params.w, params.h), params.mode
+    )
+    cache = request.app.state.render_cache
+    try:
+        path = await cache.get(name, render)
+    except FileNotFoundError as err:
+        raise not_found from err
+    return MediaFileResponse(path, on_close=partial(cache.release, name))
+
+
+@image_router.patch(
+    "/{image_id}/",
+    response_model=schemas.ImageResponse,
+    response_class=fa.responses.ORJSONResponse,
+)
 async def update_images(
     image_id: int,
     data_image: schemas.ImageUpdate,
     session: AsyncSessionDepency,
+    catalog: TagCatalogDepency,
 ):
-    image: models.Image = await crud.get_item_id(
-        session, models.Image, image_id
-    )
-    data = data_image.model_dump(exclude_unset=True)
-    if "tags" in data:
-        tags = data.pop("tags")
-        tags_set = set(tags).difference(set(tag.id for tag in image.tags))
-        tags_list = await session.scalars(
-            sa.select(models.Tag).where(models.Tag.id.in_(tags_set))
+    data = data_image.model_dump(exclude_unset=True, exclude_none=True)
+    tags = data.pop("tags", None)
+    mode = data.pop("tags_mode", schemas.TagsMode.add)
+    image = await crud.update_image(session, image_id, data, tags, mode)
+    if image is None:
+        raise fa.HTTPException(
+            status_code=fa.status.HTTP_404_NOT_FOUND,
+            detail="Image not found",
         )
-        tags_all = tags_list.all()
-        for tag in tags_all:
-            image.tags.append(tag)
-    if len(data.keys()) > 0:
-        data["id"] = image_id
-        await crud.update_item(session, models.Image, data)
-    await session.commit()
-    await session.refresh(image)
-    return image
+    images = await dump_images([image], catalog)
+    return fa.responses.ORJSONResponse(images[0])
 
 
-@image_router.delete("/{image_id}/", response_class=fa.responses.JSONResponse)
-async def delete_images(image_id: int, session: AsyncSessionDepency):
-    image: models.Image = await crud.get_item_id(
-        session, models.Image, image_id
+def collect_garbage(request: fa.Request, images: Sequence[RowMapping]) -> None:
+    for image in images:
+        request.app.state.garbage.collect(image["file_path"])
+
+
+@image_router.delete(
+    "/group/{identifier}/",
+    response_class=fa.responses.JSONResponse,
+    dependencies=[fa.Depends(get_current_user)],
+)
+async def delete_image_group(
+    identifier: UUID,
+    request: fa.Request,
+    session: AsyncSessionDepency,
+    redis: RedisDepency,
+):
+    """
+    Every variant of an upload, the whole MEDIA_DIR/<uuid> directory with
+    the original and its on-demand renders go to the garbage collector
+    """
+    images = await crud.delete_images(session, uuid=identifier)
+    await redis.delete(content_index.original_key(str(identifier)))
+    garbage = request.app.state.garbage
+    media_dir_image = config.MEDIA_DIR / str(identifier)
+    if images or media_dir_image.exists():
+        garbage.collect(media_dir_image)
+    for path in request.app.state.render_cache.evict(f"{identifier}_"):
+        garbage.collect(path)
+    return fa.responses.JSONResponse(
+        content={"detail": "Images delete", "deleted": len(images)},
+        status_code=fa.status.HTTP_200_OK,
     )
-    if image.file_path:
-        os.remove(image.file_path)
 
-    await session.execute(
-        sa.delete(models.Image).filter(
-            image.id == image_id  # type:ignore[arg-type]
-        )
+
+@image_router.delete(
+    "/",
+    response_class=fa.responses.JSONResponse,
+    dependencies=[fa.Depends(get_current_user)],
+)
+async def delete_images_bulk(
+    params: Annotated[schemas.ImageDelete, fa.Depends()],
+    request: fa.Request,
+    session: AsyncSessionDepency,
+):
+    images = await crud.delete_images(session, ids=params.ids)
+    collect_garbage(request, images)
+    return fa.responses.JSONResponse(
+        content={"detail": "Images delete", "deleted": len(images)},
+        status_code=fa.status.HTTP_200_OK,
     )
-    await session.commit()
+
+
+@image_router.delete("/{image_id}/", response_class=fa.responses.JSONResponse)
+async def delete_images(
+    image_id: int, request: fa.Request, session: AsyncSessionDepency
+):
+    images = await crud.delete_images(session, ids=[image_id])
+    if not images:
+        raise fa.HTTPException(
+            status_code=fa.status.HTTP_404_NOT_FOUND,
+            detail="Image not found",
+        )
+    collect_garbage(request, images)
     return fa.responses.JSONResponse(
         content="Image delete", status_code=fa.status.HTTP_200_OK
     )
@@ -0,0 +1,221 @@
+"""
+End-to-end latency and throughput of the API, plus image conversion time
+by image size and resolution count. Runs in-process: requests go through
+the ASGI transport, Celery tasks run eagerly, Postgres and Redis are the
+local ones from docker-compose-db.yaml (a temporary database is created
+and migrated for the run).
+
+Run from the `apps` directory:
+
+    python -m benchmarks.bench_api --requests 200 --concurrency 10
+
+Results are saved to benchmarks/results/api-<revision>.json, compare two
+runs with `python -m benchmarks.compare`.
+"""
+
+import argparse
+import asyncio
+import io
+import statistics
+import tempfile
+import time
+from typing import Any, Awaitable, Callable
+from uuid import uuid4
+
+import celery_app
+import sqlalchemy as sa
+from alembic.command import upgrade
+from benchmarks.utils import save_results, summarize
+from httpx import ASGITransport, AsyncClient, Response
+from main import app, lifespan
+from PIL import Image
+from settings import config
+from sqlalchemy.engine.url import make_url
+from tests.utils import async_tmp_database, make_alembic_config
+
+
+Call = Callable[[int], Awaitable[Response]]
+
+
+def make_image(size: tuple[int, int], format_: str = "JPEG") -> bytes:
+    image = Image.effect_mandelbrot(size, (-2.0, -1.5, 1.0, 1.5), 100)
+    buffer = io.BytesIO()
+    image.convert("RGB").save(buffer, format_)
+    return buffer.getvalue()
+
+
+def make_resolutions(count: int) -> list[str]:
+    return [f"{64 * (i + 1)}x{48 * (i + 1)}" for i in range(count)]
+
+
+def configure_celery() -> None:
+    celery_app.celery_app.conf.update(
+        task_always_eager=True,
+        broker_url="memory://",
+        result_backend="cache+memory://",
+    )
+
+
+def lift_limits() -> None:
+    """
+    The benchmark uploads far more than a user is allowed to
+    """
+    config.UPLOAD_RATE = config.BATCH_RATE = 1e9
+    config.UPLOAD_BURST = config.BATCH_BURST = 10**9
+
+
+async def measure(
+    call: Call, requests: int, concurrency: int
+) -> dict[str, float]:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: list[float] = []
+
+    async def timed(number: int) -> None:
+        async with semaphore:
+            start = time.perf_counter()
+            response = await call(number)
+            latencies.append(time.perf_counter() - start)
+            response.raise_for_status()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(timed(number) for number in range(requests)))
+    return summarize(latencies, time.perf_counter() - start)
+
+
+async def bench_http(args: argparse.Namespace) -> dict[str, Any]:
+    async with lifespan(app), AsyncClient(  # type: ignore[arg-type]
+        transport=ASGITransport(app=app),  # type: ignore[arg-type]
+        base_url="http://bench",
+    ) as client:
+        user = {"email": f"{uuid4().hex}@bench.com", "password": "password"}
+        await client.post("/users/", json=user)
+        response = await client.post("/users/login", json=user)
+        headers = {"Authorization": f"Bearer {response.json()['token']}"}
+        for name in ("dom", "maf", "pop"):
+            await client.post("/tags/", json={"name": name})
+
+        image = make_image(args.image_size)
+        run = uuid4().bytes
+
+        def unique(number: int) -> bytes:
+            # bytes after the end of the JPEG change the content hash but
+            # not the decoded image, so every upload is converted
+            return image + run + number.to_bytes(4, "big")
+
+        data = {
+            "resolutions": make_resolutions(args.resolutions),
+            "tags": [1, 2],
+        }
+        calls: dict[str, Call] = {
+            "login": lambda _: client.post("/users/login", json=user),
+            "upload": lambda number: client.post(
+                "/images/",
+                files={"image": ("bench.jpg", unique(number), "image/jpeg")},
+                data=data,
+                headers=headers,
+            ),
+            # the same content every time: only the first one is converted
+            "upload-dedup": lambda _: client.post(
+                "/images/",
+                files={"image": ("bench.jpg", image, "image/jpeg")},
+                data=data,
+                headers=headers,
+            ),
+            "list": lambda _: client.get(
+                "/images/", params={"limit": 50}, headers=headers
+            ),
+            "patch": lambda number: client.patch(
+                f"/images/{number % args.requests + 1}/",
+                json={"title": f"title{number}", "tags": [3]},
+            ),
+            "result": lambda _: client.get("/images/result/", headers=headers),
+        }
+        return {
+            name: await measure(call, args.requests, args.concurrency)
+            for name, call in calls.items()
+        }
+
+
+def bench_conversion(args: argparse.Namespace) -> dict[str, Any]:
+    results = {}
+    with tempfile.TemporaryDirectory() as media_dir:
+        for size in args.conversion_sizes:
+            path = f"{media_dir}/{size[0]}x{size[1]}.jpg"
+            with open(path, "wb") as file:
+                file.write(make_image(size))
+            for count in args.resolution_counts:
+                dict_ = {
+                    "media_dir": media_dir,
+                    "media_image": path,
+                    "file_name": "bench",
+                    "uuid": str(uuid4()),
+                    "resolutions": make_resolutions(count),
+                }
+                timings = []
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    variants = celery_app.get_variants(dict_)
+                    with celery_app.open_source(path, variants) as image:
+                        for variant in variants:
+                            celery_app.make_variant(image, variant, dict_)
+                    timings.append(time.perf_counter() - start)
+                results[f"{size[0]}x{size[1]}/{count}"] = {
+                    "ms": statistics.median(timings) * 1000
+                }
+    return results
+
+
+def parse_size(value: str) -> tuple[int, int]:
+    width, height = value.split("x")
+    return int(width), int(height)
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--image-size", type=parse_size, default="640x480")
+    parser.add_argument("--resolutions", type=int, default=2)
+    parser.add_argument(
+        "--conversion-sizes",
+        type=parse_size,
+        nargs="+",
+        default=[(640, 480), (1920, 1080), (4000, 3000)],
+    )
+    parser.add_argument(
+        "--resolution-counts", type=int, nargs="+", default=[1, 5, 10]
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--skip-http", action="store_true")
+    args = parser.parse_args()
+
+    results: dict[str, Any] = {"args": vars(args)}
+    if not args.skip_http:
+        configure_celery()
+        lift_limits()
+        async with async_tmp_database(
+            config.async_dsn, suffix="bench"  # type: ignore[arg-type]
+        ) as url:
+            config.DB_NAME = make_url(url).database  # type: ignore
+            upgrade(make_alembic_config(config.dsn), "head")  # type: ignore
+            celery_app.engine = sa.create_engine(
+                config.dsn  # type: ignore[call-overload]
+            )
+            try:
+                results["http"] = await bench_http(args)
+            finally:
+                celery_app.engine.dispose()
+    results["conversion"] = bench_conversion(args)
+
+    for name, value in results.get("http", {}).items():
+        print(
+            f"{name:<12} {value['rps']:8.1f} rps  p50 {value['p50_ms']:7.1f}"
+            f"  p95 {value['p95_ms']:7.1f}  p99 {value['p99_ms']:7.1f} ms"
+        )
+    for name, value in results["conversion"].items():
+        print(f"convert {name:<16} {value['ms']:9.1f} ms")
+    print(f"Saved to {save_results('api', results)}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,99 @@
+"""
+Bytes and encode time of a thumbnail per output format: the original's
+format with Pillow's defaults (before) and the formats ImageCreate can
+request. AVIF is skipped when this Pillow can't write it.
+
+Run from the `apps` directory on a directory of sample images:
+
+    python -m benchmarks.bench_encoders --corpus ~/photos --size 320x240
+"""
+
+import argparse
+import statistics
+import time
+from pathlib import Path
+from typing import Any
+
+import encoders
+from benchmarks.utils import save_results
+from PIL import Image
+
+
+SETTINGS: tuple[tuple[str, str, int | None, int | None], ...] = (
+    ("original", encoders.ORIGINAL, None, None),
+    ("jpeg q85", "jpeg", 85, None),
+    ("webp q80 e4", "webp", 80, 4),
+    ("webp q80 e6", "webp", 80, 6),
+    ("avif q60 e2", "avif", 60, 2),
+)
+
+
+def load_corpus(
+    corpus: Path, size: tuple[int, int]
+) -> list[tuple[Image.Image, str | None]]:
+    images = []
+    for path in sorted(corpus.iterdir()):
+        try:
+            with Image.open(path) as image:
+                images.append((image.resize(size), image.format))
+        except OSError:
+            continue
+    return images
+
+
+def run(
+    images: list[tuple[Image.Image, str | None]],
+    format_: str,
+    quality: int | None,
+    effort: int | None,
+    repeat: int,
+) -> dict[str, Any]:
+    sizes, timings = [], []
+    for image, source_format in images:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            data, _ = encoders.encode(
+                image, source_format, format_, quality, effort
+            )
+            timings.append(time.perf_counter() - start)
+        sizes.append(len(data))
+    return {
+        "images": len(images),
+        "total_kb": sum(sizes) / 1024,
+        "mean_kb": statistics.mean(sizes) / 1024,
+        "encode_ms": statistics.mean(timings) * 1000,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--corpus", type=Path, default=Path(__file__).parent.parent / "tests"
+    )
+    parser.add_argument("--size", default="320x240")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    width, height = args.size.split("x")
+    images = load_corpus(args.corpus, (int(width), int(height)))
+    if not images:
+        parser.error(f"No images in {args.corpus}")
+
+    print(f"{len(images)} images resized to {args.size}")
+    results = {}
+    for name, format_, quality, effort in SETTINGS:
+        if not encoders.supported(format_):
+            print(f"{name:>12}: not supported")
+            continue
+        result = run(images, format_, quality, effort, args.repeat)
+        results[name] = result
+        print(
+            f"{name:>12}: {result['mean_kb']:8.1f} KiB/image, "
+            f"{result['encode_ms']:8.2f} ms/image"
+        )
+    path = save_results("encoders", {"size": args.size, "results": results})
+    print(f"Saved to {path}")
+
+
+if __name__ == "__main__":
+    main()
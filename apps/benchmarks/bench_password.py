@@ -0,0 +1,94 @@
+"""
+Concurrent login throughput with bcrypt running on the event loop (before)
+and in the bounded hasher executor (after). Max event loop lag shows how
+long unrelated requests would have been frozen.
+
+Run from the `apps` directory:
+
+    python -m benchmarks.bench_password --logins 32 --rounds 12
+
+Results are saved to benchmarks/results/password-<revision>.json.
+"""
+
+import argparse
+import asyncio
+import time
+from typing import Any, Awaitable, Callable
+
+import bcrypt
+import security
+from benchmarks.utils import save_results
+from settings import config
+
+
+Login = Callable[[str, str], Awaitable[bool]]
+
+
+async def blocking_login(password: str, hashed_password: str) -> bool:
+    return security.verify_password(password, hashed_password)
+
+
+async def offloaded_login(password: str, hashed_password: str) -> bool:
+    return await security.async_verify_password(password, hashed_password)
+
+
+async def heartbeat(stop: asyncio.Event, interval: float = 0.005) -> float:
+    max_lag = 0.0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        max_lag = max(max_lag, time.perf_counter() - start - interval)
+    return max_lag
+
+
+async def run(
+    login: Login, logins: int, password: str, hashed_password: str
+) -> dict[str, float]:
+    stop = asyncio.Event()
+    lag = asyncio.create_task(heartbeat(stop))
+    await asyncio.sleep(0)
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(login(password, hashed_password) for _ in range(logins))
+    )
+    elapsed = time.perf_counter() - start
+    stop.set()
+    return {
+        "logins_per_second": logins / elapsed,
+        "max_loop_lag_ms": await lag * 1000,
+    }
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=32)
+    parser.add_argument("--rounds", type=int, default=12)
+    args = parser.parse_args()
+
+    password = "password"
+    salt = bcrypt.gensalt(rounds=args.rounds)
+    hashed_password = bcrypt.hashpw(password.encode(), salt).decode()
+
+    results: dict[str, Any] = {
+        "args": {**vars(args), "workers": config.BCRYPT_MAX_WORKERS}
+    }
+    print(
+        f"{args.logins} concurrent logins, bcrypt rounds={args.rounds}, "
+        f"hasher workers={config.BCRYPT_MAX_WORKERS}"
+    )
+    for name, login in (
+        ("before", blocking_login),
+        ("after", offloaded_login),
+    ):
+        result = results[name] = await run(
+            login, args.logins, password, hashed_password
+        )
+        print(
+            f"{name:>6}: {result['logins_per_second']:8.1f} logins/s, "
+            f"max loop lag {result['max_loop_lag_ms']:8.1f} ms"
+        )
+    print(f"Saved to {save_results('password', results)}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
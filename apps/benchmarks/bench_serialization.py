@@ -0,0 +1,112 @@
+"""
+CPU cost of turning a page of images into a response body, without the
+database: ORM objects validated by FastAPI through `from_attributes` and
+rendered by the stdlib json (before), plain rows with tag ids resolved
+by the tag catalog, validated by the cached TypeAdapter and rendered by
+orjson (after).
+
+Run from the `apps` directory:
+
+    python -m benchmarks.bench_serialization --sizes 50 200 --tags 5
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable
+
+import models
+import schemas
+from benchmarks.utils import save_results
+from fastapi.responses import JSONResponse, ORJSONResponse
+from tag_catalog import TagCatalog
+
+from api import dump_images
+
+
+def make_rows(size: int, tags: int) -> list[dict[str, Any]]:
+    return [
+        {
+            "id": i,
+            "title": f"image_{i}_100x100",
+            "file_path": f"/media/{i}/image_{i}_100x100.JPEG",
+            "data": datetime(2026, 1, 1, 12, 0, i % 60),
+            "resolution": "100x100",
+            "size": 4096 + i,
+            "tag_ids": list(range(tags)),
+        }
+        for i in range(size)
+    ]
+
+
+def make_objects(rows: list[dict[str, Any]]) -> list[models.Image]:
+    images = []
+    for row in rows:
+        tags = [models.Tag(id=i, name=f"tag{i}") for i in row["tag_ids"]]
+        images.append(models.Image(**row_without_tags(row), tags=tags))
+    return images
+
+
+def row_without_tags(row: dict[str, Any]) -> dict[str, Any]:
+    return {key: value for key, value in row.items() if key != "tag_ids"}
+
+
+def make_catalog(tags: int) -> TagCatalog:
+    catalog = TagCatalog(None, None)  # type: ignore[arg-type]
+    catalog.tags = {i: f"tag{i}" for i in range(tags)}
+    return catalog
+
+
+async def orm_body(images: list[models.Image]) -> bytes:
+    page = schemas.ImagePage.model_validate({"items": images})
+    return bytes(JSONResponse(page.model_dump(mode="json")).body)
+
+
+def rows_body(catalog: TagCatalog) -> Callable[[Any], Awaitable[bytes]]:
+    async def render(rows: list[dict[str, Any]]) -> bytes:
+        items = await dump_images(rows, catalog)  # type: ignore[arg-type]
+        return bytes(ORJSONResponse({"items": items}).body)
+
+    return render
+
+
+async def run(
+    render: Callable[[Any], Awaitable[bytes]], page: Any, repeat: int
+) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await render(page)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=(50, 200))
+    parser.add_argument("--tags", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    results = {}
+    for size in args.sizes:
+        rows = make_rows(size, args.tags)
+        before = await run(orm_body, make_objects(rows), args.repeat)
+        after = await run(
+            rows_body(make_catalog(args.tags)), rows, args.repeat
+        )
+        results[size] = {"before_ms": before, "after_ms": after}
+        print(
+            f"page of {size:>4}: before {before:7.3f} ms, "
+            f"after {after:7.3f} ms ({before / after:4.1f}x)"
+        )
+    path = save_results(
+        "serialization", {"tags": args.tags, "results": results}
+    )
+    print(f"Saved to {path}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
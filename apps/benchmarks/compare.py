@@ -0,0 +1,46 @@
+"""
+Compare two benchmark result files:
+
+    python -m benchmarks.compare results/api-abc1234.json \
+        results/api-def5678.json
+"""
+
+import argparse
+import json
+from pathlib import Path
+from typing import Any, Iterator
+
+
+def flatten(data: Any, prefix: str = "") -> Iterator[tuple[str, float]]:
+    if isinstance(data, dict):
+        for key, value in data.items():
+            yield from flatten(value, f"{prefix}.{key}" if prefix else key)
+    elif isinstance(data, list):
+        for index, value in enumerate(data):
+            yield from flatten(value, f"{prefix}[{index}]")
+    elif isinstance(data, (int, float)) and not isinstance(data, bool):
+        yield prefix, float(data)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("old", type=Path)
+    parser.add_argument("new", type=Path)
+    args = parser.parse_args()
+
+    old = json.loads(args.old.read_text())
+    new = json.loads(args.new.read_text())
+    old.pop("args", None)
+    new.pop("args", None)
+    old_values = dict(flatten(old))
+    print(f"{old.get('revision')} -> {new.get('revision')}")
+    for key, value in flatten(new):
+        if key not in old_values:
+            continue
+        before = old_values[key]
+        change = (value - before) / before * 100 if before else 0.0
+        print(f"{key:<50} {before:12.2f} {value:12.2f} {change:+8.1f}%")
+
+
+if __name__ == "__main__":
+    main()
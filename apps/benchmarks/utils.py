@@ -0,0 +1,53 @@
+import json
+import statistics
+import subprocess
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any
+
+
+RESULTS_DIR = Path(__file__).parent / "results"
+
+
+def percentile(values: list[float], q: int) -> float:
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[q - 1]
+
+
+def summarize(latencies: list[float], elapsed: float) -> dict[str, float]:
+    """
+    Latencies and elapsed time in seconds, percentiles in milliseconds
+    """
+    return {
+        "requests": len(latencies),
+        "rps": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def save_results(name: str, results: dict[str, Any]) -> Path:
+    revision = git_revision()
+    results = {
+        "revision": revision,
+        "date": datetime.now(timezone.utc).isoformat(),
+        **results,
+    }
+    RESULTS_DIR.mkdir(exist_ok=True)
+    path = RESULTS_DIR / f"{name}-{revision}.json"
+    path.write_text(json.dumps(results, indent=2))
+    return path
@@ -0,0 +1,65 @@
+from fastapi import HTTPException, status
+from fastapi.responses import JSONResponse
+from settings import config
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+UPLOAD_PATHS = {"/images/": 1, "/images/batch/": None}
+
+
+def max_body_size(scope: Scope) -> int | None:
+    """
+    Upload body limit of the request, None when it isn't an upload. The
+    batch one is for BATCH_MAX_FILES files
+    """
+    if scope["method"] != "POST" or scope["path"] not in UPLOAD_PATHS:
+        return None
+    files = UPLOAD_PATHS[scope["path"]] or config.BATCH_MAX_FILES
+    return files * config.MAX_UPLOAD_SIZE + config.MAX_FORM_SIZE
+
+
+def too_large(max_size: int) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=f"Request body is larger than {max_size} bytes",
+    )
+
+
+class BodyLimitMiddleware:
+    """
+    Pure ASGI, rejects an upload while it is received instead of after
+    it is spooled: right away by its Content-Length, else as soon as the
+    streamed bytes cross the limit
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        max_size = None
+        if scope["type"] == "http":
+            max_size = max_body_size(scope)
+        if max_size is None:
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope["headers"])
+        content_length = headers.get(b"content-length", b"").decode()
+        if content_length.isdigit() and int(content_length) > max_size:
+            error = too_large(max_size)
+            response = JSONResponse(
+                {"detail": error.detail}, status_code=error.status_code
+            )
+            await response(scope, receive, send)
+            return
+        received = 0
+
+        async def receive_limited() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_size:
+                    raise too_large(max_size)
+            return message
+
+        await self.app(scope, receive_limited, send)
@@ -0,0 +1,110 @@
+import time
+from collections import OrderedDict
+from typing import Generic, Hashable, TypeVar
+
+import schemas
+from redis.asyncio import Redis
+from settings import config
+
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class TTLCache(Generic[K, V]):
+    """
+    In-process LRU cache, entries expire after `ttl` seconds
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[K, tuple[float, V]] = OrderedDict()
+
+    def get(self, key: K) -> V | None:
+        item = self._data.get(key)
+        if item is None or item[0] < time.monotonic():
+            if item is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return item[1]
+
+    def set(self, key: K, value: V, ttl: float | None = None) -> None:
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: K) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+
+class UserCache:
+    """
+    Authenticated users by email and emails by token. When `redis` is set,
+    users are kept in Redis instead of the process, so all gunicorn
+    workers share entries and invalidations
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.ttl = ttl
+        self.tokens: TTLCache[str, str] = TTLCache(maxsize, ttl)
+        self.users: TTLCache[str, schemas.UserResponse] = TTLCache(
+            maxsize, ttl
+        )
+        self.redis: Redis | None = None
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(email: str) -> str:
+        return f"user:{email}"
+
+    async def get(self, email: str) -> schemas.UserResponse | None:
+        if self.redis is None:
+            user = self.users.get(email)
+        else:
+            data = await self.redis.get(self.key(email))
+            user = None
+            if data is not None:
+                user = schemas.UserResponse.model_validate_json(data)
+        if user is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return user
+
+    async def set(self, user: schemas.UserResponse) -> None:
+        if self.redis is None:
+            self.users.set(user.email, user)
+        else:
+            await self.redis.set(
+                self.key(user.email),
+                user.model_dump_json(),
+                ex=int(self.ttl),
+            )
+
+    async def invalidate(self, email: str) -> None:
+        self.users.pop(email)
+        if self.redis is not None:
+            await self.redis.delete(self.key(email))
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "user_hits": self.hits,
+            "user_misses": self.misses,
+            "token_hits": self.tokens.hits,
+            "token_misses": self.tokens.misses,
+        }
+
+
+user_cache = UserCache(config.USER_CACHE_SIZE, config.USER_CACHE_TTL)
@@ -1,72 +1,342 @@
 import json
+import logging
+import math
+import os
 from pathlib import Path
-from typing import Any, Sequence
+from typing import Any
 
-import models
+import content_index
+import crud
+import encoders
+import jobs
+import metrics
 import redis
+import schemas
 import sqlalchemy as sa
+import tracing
 import utils
-from celery import Celery
+from celery import Celery, chord
+from celery.exceptions import SoftTimeLimitExceeded
+from celery.signals import worker_init, worker_process_init
+from kombu import Queue
 from PIL import Image
+from prometheus_client import REGISTRY, start_http_server
+from prometheus_client.multiprocess import MultiProcessCollector
+from prometheus_client.registry import CollectorRegistry
 from settings import config
 from sqlalchemy.orm import Session
 
 
+logger = logging.getLogger(__name__)
+
+GRAYSCALE = "L"
+SMALL_QUEUE = "convert.small"
+LARGE_QUEUE = "convert.large"
+MAX_PRIORITY = 9
+
 celery_app = Celery(
-    "crypto", broker=config.rabbit_url, broker_connection_retry_on_startup=True
+    "crypto",
+    broker=config.rabbit_url,
+    backend=config.redis_url,
+    broker_connection_retry_on_startup=True,
 )
+celery_app.conf.task_queues = (
+    Queue("celery"),
+    Queue(SMALL_QUEUE, queue_arguments={"x-max-priority": MAX_PRIORITY}),
+    Queue(LARGE_QUEUE, queue_arguments={"x-max-priority": MAX_PRIORITY}),
+)
+celery_app.conf.task_routes = {
+    "celery_app.variants_saver": {"queue": SMALL_QUEUE}
+}
+time_limits = {
+    "soft_time_limit": config.CONVERT_SOFT_TIME_LIMIT,
+    "time_limit": config.CONVERT_TIME_LIMIT,
+}
 engine = sa.create_engine(config.dsn)  # type:ignore[call-overload]
 
 redis_app = redis.Redis().from_url(config.redis_url)  # type:ignore[arg-type]
 
 
-def write_tags_to_images(
-    session: Session, data: dict[str, Any], tags_list: Sequence[models.Tag]
-):
-    stmt = sa.insert(models.Image).returning(models.Image).values(**data)
-    image = session.scalar(stmt)
-    session.flush()
-    image.tags = tags_list  # type:ignore[union-attr]
-    session.flush()
+@worker_init.connect
+def start_metrics_server(**_kwargs) -> None:
+    """
+    Prefork children share their metrics through PROMETHEUS_MULTIPROC_DIR
+    """
+    if config.WORKER_METRICS_PORT is None:
+        return
+    registry = REGISTRY
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        MultiProcessCollector(registry)
+    start_http_server(config.WORKER_METRICS_PORT, registry=registry)
 
 
-@celery_app.task
-def image_convertor(dict_str: str):  # pylint:disable=R0914
-    dict_ = json.loads(dict_str)
-    media_dir = Path(dict_["media_dir"])
-    file_name = dict_["file_name"]
-    identifier = dict_["uuid"]
+@worker_process_init.connect
+def start_tracing(**_kwargs) -> None:
+    tracing.setup("images-worker")
 
-    with Session(engine) as session:
-        tags = session.scalars(
-            sa.select(models.Tag).where(models.Tag.id.in_(dict_["tags"]))
-        )
-        tags_list = tags.all()
-        image_pillow = Image.open(dict_["media_image"])
+
+def get_variants(dict_: dict[str, Any]) -> list[str]:
+    if "variants" in dict_:
+        return dict_["variants"]
+    return [*dict_["resolutions"], GRAYSCALE]
+
+
+def get_size(variant: str) -> tuple[int, int]:
+    width, height = variant.split("x")
+    return int(width), int(height)
+
+
+def budget_size(size: tuple[int, int], budget: int) -> tuple[int, int]:
+    """
+    `size` scaled down, keeping the aspect ratio, to fit `budget` pixels
+    """
+    width, height = size
+    if width * height <= budget:
+        return size
+    scale = math.sqrt(budget / (width * height))
+    return max(int(width * scale), 1), max(int(height * scale), 1)
+
+
+def decode_size(variants: list[str], size: tuple[int, int]) -> tuple[int, int]:
+    """
+    Smallest size that covers every variant of an image of `size`. The
+    grayscale copy is full size up to IMAGE_PIXEL_BUDGET pixels and is
+    downscaled to at most the budget for bigger images
+    """
+    sizes = [get_size(variant) for variant in variants if variant != GRAYSCALE]
+    if GRAYSCALE in variants:
+        sizes.append(budget_size(size, config.IMAGE_PIXEL_BUDGET))
+    return max(w for w, _ in sizes), max(h for _, h in sizes)
+
+
+def open_image(
+    path: str, size: tuple[int, int] | None = None, mode: str | None = None
+) -> Image.Image:
+    """
+    Decode the image once. JPEG is decoded right away at the smallest
+    scale (1/2, 1/4 or 1/8) that still covers `size`, and in `mode`
+    """
+    image_pillow = Image.open(path)
+    if size is not None or mode is not None:
+        image_pillow.draft(mode, size or image_pillow.size)
+    image_pillow.load()
+    return image_pillow
+
+
+def open_source(path: str, variants: list[str]) -> Image.Image:
+    """
+    Decode the original once for `variants`. Only JPEG is decoded at a
+    reduced scale; every other format is always decoded at full size and
+    then reduced by an integer factor, so that only about the size the
+    variants need stays alive during the resizes
+    """
+    image_pillow = Image.open(path)
+    size = decode_size(variants, image_pillow.size)
+    mode = GRAYSCALE if variants == [GRAYSCALE] else None
+    image_pillow.draft(mode, size)
+    image_pillow.load()
+    factor = min(image_pillow.width // size[0], image_pillow.height // size[1])
+    if factor < 2:
+        return image_pillow
+    with image_pillow:
+        reduced = image_pillow.reduce(factor)
+    reduced.format = image_pillow.format
+    return reduced
+
+
+def render_variant(
+    original: str,
+    size: tuple[int, int],
+    mode: str | None,
+    file_path: Path,
+) -> None:
+    with open_image(original, size, mode) as image_pillow:
         format_ = image_pillow.format
+        new_image = image_pillow.resize(
+            size, reducing_gap=config.RESIZE_REDUCING_GAP
+        )
+    if mode is not None and new_image.mode != mode:
+        new_image = new_image.convert(mode)
+    new_image.save(file_path, format=format_)
 
-        for resolution in dict_["resolutions"]:
-            width, height = resolution.split("x")
-            new_image = image_pillow.resize((int(width), int(height)))
 
-            title = f"{file_name}_{width}x{height}"
-            file_path = str(media_dir / f"{title}.{format_}")
-            new_image.save(file_path)
+def make_variant(
+    image_pillow: Image.Image, variant: str, dict_: dict[str, Any]
+) -> dict[str, Any]:
+    file_name = dict_["file_name"]
+    format_ = image_pillow.format
 
-            dict_image = utils.make_image_data(
-                file_path, title, resolution, identifier
+    title = utils.variant_title(file_name, variant)
+    with metrics.stage("resize"):
+        if variant == GRAYSCALE:
+            size = budget_size(image_pillow.size, config.IMAGE_PIXEL_BUDGET)
+            new_image = image_pillow
+            if size != image_pillow.size:
+                new_image = image_pillow.resize(
+                    size, reducing_gap=config.RESIZE_REDUCING_GAP
+                )
+            new_image = new_image.convert("L")
+            resolution = "x".join(str(x) for x in new_image.size)
+        else:
+            resample = dict_.get("resample", schemas.Resample.bicubic)
+            new_image = image_pillow.resize(
+                get_size(variant),
+                Image.Resampling[resample.upper()],
+                reducing_gap=config.RESIZE_REDUCING_GAP,
             )
-            write_tags_to_images(session, dict_image, tags_list)
-
-        image_gray = image_pillow.convert("L")
-        file_path = str(media_dir / f"{file_name}_L.{format_}")
-        image_gray.save(file_path)
-        dict_image = utils.make_image_data(
-            file_path,
-            f"{file_name}_L",
-            "x".join(str(x) for x in image_gray.size),
-            identifier,
+            resolution = variant
+
+    with metrics.stage("encode"):
+        data, suffix = encoders.encode(
+            new_image,
+            format_,
+            dict_.get("format", encoders.ORIGINAL),
+            dict_.get("quality"),
+            dict_.get("effort"),
         )
-        write_tags_to_images(session, dict_image, tags_list)
+    new_image.close()
+    file_path = str(Path(dict_["media_dir"]) / f"{title}.{suffix}")
+    with metrics.stage("write"):
+        with open(file_path, "wb") as file:
+            file.write(data)
+    return utils.make_image_data(file_path, title, resolution, dict_["uuid"])
+
+
+def save_images(dict_: dict[str, Any], images: list[dict[str, Any]]):
+    with metrics.stage("db"), Session(engine) as session:
+        session.execute(crud.insert_images_stmt(images, dict_["tags"]))
         session.commit()
-        redis_app.set(dict_["user_email"], identifier)
+    content_index.remember(redis_app, dict_, get_variants(dict_), images)
+    redis_app.set(dict_["user_email"], dict_["uuid"])
+    jobs.finish(redis_app, dict_["uuid"])
+
+
+def convert(dict_: dict[str, Any]) -> None:
+    variants = get_variants(dict_)
+    try:
+        with metrics.track_peak_rss():
+            images = convert_variants(dict_, variants)
+        save_images(dict_, images)
+    except Exception:
+        jobs.finish(redis_app, dict_["uuid"], jobs.FAILED)
+        raise
+
+
+def convert_variants(
+    dict_: dict[str, Any], variants: list[str]
+) -> list[dict[str, Any]]:
+    images = []
+    with metrics.stage("decode"):
+        image = open_source(dict_["media_image"], variants)
+    with image:
+        for variant in variants:
+            try:
+                images.append(make_variant(image, variant, dict_))
+            except Exception:
+                jobs.finish(redis_app, dict_["uuid"], jobs.FAILED, variant)
+                raise
+            jobs.variant_done(redis_app, dict_["uuid"], variant)
+    return images
+
+
+@celery_app.task(**time_limits)
+def image_convertor(dict_str: str):
+    convert(json.loads(dict_str))
+
+
+@celery_app.task
+def batch_convertor(dicts_str: str):
+    dicts = json.loads(dicts_str)
+    for i, dict_ in enumerate(dicts):
+        try:
+            convert(dict_)
+        except SoftTimeLimitExceeded:
+            for rest in dicts[i + 1 :]:
+                jobs.finish(redis_app, rest["uuid"], jobs.FAILED)
+            raise
+        except Exception:  # pylint:disable=W0718
+            logger.exception("Conversion of %s failed", dict_["uuid"])
+
+
+@celery_app.task(**time_limits)
+def variant_convertor(dict_str: str, variant: str) -> dict[str, Any]:
+    dict_ = json.loads(dict_str)
+    try:
+        with metrics.track_peak_rss():
+            with metrics.stage("decode"):
+                image_pillow = open_source(dict_["media_image"], [variant])
+            with image_pillow:
+                dict_image = make_variant(image_pillow, variant, dict_)
+    except Exception:
+        jobs.finish(redis_app, dict_["uuid"], jobs.FAILED, variant)
+        raise
+    jobs.variant_done(redis_app, dict_["uuid"], variant)
+    return dict_image
+
+
+@celery_app.task(**time_limits)
+def variants_saver(images: list[dict[str, Any]], dict_str: str):
+    dict_ = json.loads(dict_str)
+    try:
+        save_images(dict_, images)
+    except Exception:
+        jobs.finish(redis_app, dict_["uuid"], jobs.FAILED)
+        raise
+
+
+def conversion_cost(dict_: dict[str, Any]) -> int:
+    return dict_.get("pixels", 0) * len(get_variants(dict_))
+
+
+def route(cost: int) -> dict[str, Any]:
+    """
+    Queue and priority for a conversion of `cost` input pixels times
+    variants. Small ones go first on their own queue and workers, big
+    ones lose a priority step per CONVERT_LARGE_COST
+    """
+    if cost < config.CONVERT_LARGE_COST:
+        return {"queue": SMALL_QUEUE, "priority": MAX_PRIORITY}
+    steps = cost // config.CONVERT_LARGE_COST
+    return {"queue": LARGE_QUEUE, "priority": max(MAX_PRIORITY - steps, 0)}
+
+
+def convert_image(dict_: dict[str, Any]) -> None:
+    """
+    Queue the conversion of an uploaded image. With CONVERT_FAN_OUT
+    every variant is rendered by its own task and a chord callback
+    saves them all once the last one is done
+    """
+    dict_str = json.dumps(dict_)
+    if not config.CONVERT_FAN_OUT:
+        image_convertor.apply_async(
+            (dict_str,), **route(conversion_cost(dict_))
+        )
+        return
+    header = (
+        variant_convertor.s(dict_str, variant).set(
+            **route(dict_.get("pixels", 0))
+        )
+        for variant in get_variants(dict_)
+    )
+    chord(header)(variants_saver.s(dict_str))
+
+
+def convert_batch(dicts: list[dict[str, Any]]) -> None:
+    """
+    Queue conversions by chunks of BATCH_CHUNK_SIZE images per task,
+    small and large images apart. Time limits grow with the chunk
+    """
+    by_queue: dict[str, list[dict[str, Any]]] = {}
+    for dict_ in dicts:
+        queue = route(conversion_cost(dict_))["queue"]
+        by_queue.setdefault(queue, []).append(dict_)
+    for queue_dicts in by_queue.values():
+        for start in range(0, len(queue_dicts), config.BATCH_CHUNK_SIZE):
+            chunk = queue_dicts[start : start + config.BATCH_CHUNK_SIZE]
+            batch_convertor.apply_async(
+                (json.dumps(chunk),),
+                soft_time_limit=config.CONVERT_SOFT_TIME_LIMIT * len(chunk),
+                time_limit=config.CONVERT_TIME_LIMIT * len(chunk),
+                **route(max(conversion_cost(dict_) for dict_ in chunk)),
+            )
@@ -0,0 +1,109 @@
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import Any
+
+import utils
+from redis import Redis
+
+
+ORIGINAL = "original"
+
+
+def key(digest: str) -> str:
+    return f"content:{digest}"
+
+
+def original_key(identifier: str) -> str:
+    return f"original:{identifier}"
+
+
+def variant_key(variant: str, dict_: dict[str, Any]) -> str:
+    """
+    Index field of a rendered variant: resolution (or mode for the
+    grayscale copy), resampling filter and output format
+    """
+    resample = "-" if "x" not in variant else dict_.get("resample", "-")
+    output = dict_.get("format", ORIGINAL)
+    if output != ORIGINAL:
+        options = (dict_.get("quality"), dict_.get("effort"))
+        output += "".join(
+            f"/{'-' if value is None else value}" for value in options
+        )
+    return f"{variant}:{resample}:{output}"
+
+
+def link_file(source: str, target: Path) -> None:
+    """
+    Hard links share the data with the stored file, so nothing is written
+    but a directory entry. Copy when the media dir spans file systems
+    """
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+
+def link_existing(
+    index: dict[str, str], dict_: dict[str, Any]
+) -> tuple[str | None, list[dict[str, Any]]]:
+    """
+    Link the stored original and the already rendered variants of the
+    same content into `dict_["media_dir"]`. Returns the linked original
+    (None, if it isn't stored) and data of the linked variants, and leaves
+    in `dict_["variants"]` only the ones still to be rendered
+    """
+    original = index.get(ORIGINAL)
+    if original is None or not os.path.exists(original):
+        return None, []
+    media_dir = Path(dict_["media_dir"])
+    media_image = media_dir / Path(original).name
+    try:
+        link_file(original, media_image)
+    except OSError:
+        # collected since the check, the upload is stored as new content
+        return None, []
+
+    images, variants = [], []
+    for variant in dict_["variants"]:
+        data = index.get(variant_key(variant, dict_))
+        stored = json.loads(data) if data is not None else {}
+        if not os.path.exists(stored.get("file_path", "")):
+            variants.append(variant)
+            continue
+        title = utils.variant_title(dict_["file_name"], variant)
+        file_path = media_dir / f"{title}{Path(stored['file_path']).suffix}"
+        try:
+            link_file(stored["file_path"], file_path)
+        except OSError:
+            variants.append(variant)
+            continue
+        images.append(
+            utils.make_image_data(
+                str(file_path), title, stored["resolution"], dict_["uuid"]
+            )
+        )
+    dict_["variants"] = variants
+    return str(media_image), images
+
+
+def remember(
+    redis_client: Redis,
+    dict_: dict[str, Any],
+    variants: list[str],
+    images: list[dict[str, Any]],
+) -> None:
+    """
+    Store rendered `images` of `variants` under the content hash of the
+    original
+    """
+    if "digest" not in dict_:
+        return
+    redis_client.hset(
+        key(dict_["digest"]),
+        mapping={
+            variant_key(variant, dict_): json.dumps(data)
+            for variant, data in zip(variants, images)
+        },
+    )
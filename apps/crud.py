@@ -1,9 +1,13 @@
-from typing import Any, Awaitable, Callable, Type
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Iterable, Sequence, Type
+from uuid import UUID
 
 import sqlalchemy as sa
+from cache import user_cache
 from fastapi import HTTPException, status
-from models import MODEL, TypeModel, User
-from sqlalchemy.engine import ScalarResult
+from models import MODEL, Image, Tag, TypeModel, User, image_tags
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.engine import RowMapping, ScalarResult
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 
@@ -79,8 +83,240 @@ async def create_or_update_user(
             ) from err
         raise err
 
+    await user_cache.invalidate(result.email)
     return result
 
 
 async def get_user(session: AsyncSession, email: str) -> User | None:
     return await session.scalar(sa.select(User).where(User.email == email))
+
+
+def insert_images_stmt(
+    data: list[dict[str, Any]], tag_ids: Iterable[int]
+) -> sa.Select[tuple[int]]:
+    """
+    Single statement, that inserts all `data` rows with one multi-row
+    INSERT and links every new image to the existing tags from `tag_ids`.
+    Returns ids of the new images
+    """
+    images = (
+        sa.insert(Image).values(data).returning(Image.id).cte("new_images")
+    )
+    links = (
+        sa.insert(image_tags)
+        .from_select(
+            ["image_id", "tag_id"],
+            sa.select(images.c.id, Tag.id).where(Tag.id.in_(tag_ids)),
+        )
+        .cte("new_image_tags")
+    )
+    return sa.select(images.c.id).add_cte(links)
+
+
+async def create_images(
+    session: AsyncSession,
+    data: list[dict[str, Any]],
+    tag_ids: Iterable[int],
+) -> list[int]:
+    if not data:
+        return []
+    result = await session.scalars(insert_images_stmt(data, tag_ids))
+    images_ids = list(result.all())
+    await session.commit()
+    return images_ids
+
+
+def update_image_stmt(
+    image_id: int,
+    values: dict[str, Any],
+    tag_ids: list[int] | None = None,
+    mode: str = "add",
+) -> sa.Select:
+    """
+    Single statement, that updates the image and adds, sets or deletes
+    its links to the existing tags from `tag_ids`. New links
+    rely on the image_tags primary key for ON CONFLICT DO NOTHING.
+    Returns the image row with its tag ids after the change, no row if
+    there is no such image
+    """
+    updated = (
+        sa.update(Image)
+        .where(Image.id == image_id)
+        .values(values or {"title": Image.title})
+        .returning(
+            Image.id,
+            Image.title,
+            Image.file_path,
+            Image.data,
+            Image.resolution,
+            Image.size,
+        )
+        .cte("updated")
+    )
+    # the statement sees the links as they were before it: the result is
+    # old links except removed ones plus inserted ones
+    tags: sa.Select | sa.CompoundSelect
+    tags = sa.select(image_tags.c.tag_id).where(
+        image_tags.c.image_id == updated.c.id
+    )
+    ctes = []
+    if tag_ids is not None and mode != "add":
+        kept = image_tags.c.tag_id.in_(tag_ids)
+        removed = (
+            sa.delete(image_tags)
+            .where(
+                image_tags.c.image_id.in_(sa.select(updated.c.id)),
+                kept if mode == "delete" else sa.not_(kept),
+            )
+            .returning(image_tags.c.tag_id)
+            .cte("removed_tags")
+        )
+        ctes.append(removed)
+        tags = sa.except_(tags, sa.select(removed.c.tag_id))
+    if tag_ids is not None and mode != "delete":
+        inserted = (
+            postgresql.insert(image_tags)
+            .from_select(
+                ["image_id", "tag_id"],
+                sa.select(updated.c.id, Tag.id).where(Tag.id.in_(tag_ids)),
+            )
+            .on_conflict_do_nothing()
+            .returning(image_tags.c.tag_id)
+            .cte("inserted_tags")
+        )
+        ctes.append(inserted)
+        tags = sa.union(tags, sa.select(inserted.c.tag_id))
+    result_tags = tags.subquery()
+    tag_list = sa.func.array(
+        sa.select(result_tags.c.tag_id)
+        .order_by(result_tags.c.tag_id)
+        .scalar_subquery()
+    )
+    return sa.select(
+        updated,
+        sa.type_coerce(tag_list, postgresql.ARRAY(sa.Integer)).label(
+            "tag_ids"
+        ),
+    ).add_cte(*ctes)
+
+
+async def update_image(
+    session: AsyncSession,
+    image_id: int,
+    values: dict[str, Any],
+    tag_ids: list[int] | None = None,
+    mode: str = "add",
+) -> RowMapping | None:
+    stmt = update_image_stmt(image_id, values, tag_ids, mode)
+    result = await session.execute(stmt)
+    image = result.mappings().one_or_none()
+    await session.commit()
+    return image
+
+
+def tagged_images(tags: list[int], match: str) -> sa.Select[tuple[int]]:
+    """
+    Ids of images with any (or all) of `tags`. Reads only the
+    (tag_id, image_id) index of image_tags
+    """
+    tag_ids = set(tags)
+    stmt = sa.select(image_tags.c.image_id).where(
+        image_tags.c.tag_id.in_(tag_ids)
+    )
+    if match == "all":
+        stmt = stmt.group_by(image_tags.c.image_id).having(
+            sa.func.count() == len(tag_ids)
+        )
+    return stmt
+
+
+def image_rows_stmt() -> sa.Select:
+    """
+    Images as plain rows with the ids of their tags, read by an
+    index-only scan of the image_tags primary key. Names come from the
+    tag catalog
+    """
+    tag_ids = (
+        sa.select(
+            sa.func.coalesce(
+                sa.func.array_agg(
+                    postgresql.aggregate_order_by(
+                        image_tags.c.tag_id, image_tags.c.tag_id
+                    )
+                ),
+                sa.literal_column("'{}'::integer[]"),
+            )
+        )
+        .where(image_tags.c.image_id == Image.id)
+        .scalar_subquery()
+    )
+    return sa.select(
+        Image.id,
+        Image.title,
+        Image.file_path,
+        Image.data,
+        Image.resolution,
+        Image.size,
+        sa.type_coerce(tag_ids, postgresql.ARRAY(sa.Integer)).label("tag_ids"),
+    )
+
+
+async def get_images_page(  # pylint:disable=R0913
+    session: AsyncSession,
+    limit: int,
+    cursor: tuple[datetime, int] | None = None,
+    *,
+    uuid: UUID | None = None,
+    tags: list[int] | None = None,
+    match: str = "any",
+    date_from: datetime | None = None,
+    date_to: datetime | None = None,
+) -> Sequence[RowMapping]:
+    """
+    Newest images first, starting right after `cursor` (keyset pagination
+    on `(data, id)`, backed by ix_images_data_id)
+    """
+    stmt = (
+        image_rows_stmt()
+        .order_by(Image.data.desc(), Image.id.desc())
+        .limit(limit)
+    )
+    if cursor is not None:
+        stmt = stmt.where(sa.tuple_(Image.data, Image.id) < cursor)
+    if uuid is not None:
+        stmt = stmt.where(Image.uuid == uuid)
+    if tags:
+        stmt = stmt.where(Image.id.in_(tagged_images(tags, match)))
+    if date_from is not None:
+        stmt = stmt.where(Image.data >= date_from)
+    if date_to is not None:
+        stmt = stmt.where(Image.data <= date_to)
+    result = await session.execute(stmt)
+    return result.mappings().all()
+
+
+async def delete_images(
+    session: AsyncSession,
+    uuid: UUID | None = None,
+    ids: list[int] | None = None,
+) -> Sequence[RowMapping]:
+    """
+    One statement for a group of images, tag links go by ON DELETE
+    CASCADE. Returns id, uuid and file_path of the deleted rows
+    """
+    stmt = sa.delete(Image).returning(Image.id, Image.uuid, Image.file_path)
+    if uuid is not None:
+        stmt = stmt.where(Image.uuid == uuid)
+    if ids is not None:
+        stmt = stmt.where(Image.id.in_(ids))
+    result = await session.execute(stmt)
+    await session.commit()
+    return result.mappings().all()
+
+
+async def get_images_by_uuid(
+    session: AsyncSession, uuid: str | None
+) -> Sequence[RowMapping]:
+    stmt = image_rows_stmt().where(Image.uuid == uuid)
+    result = await session.execute(stmt)
+    return result.mappings().all()
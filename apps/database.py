@@ -0,0 +1,114 @@
+import asyncio
+import logging
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Sequence
+
+import redis
+import sqlalchemy as sa
+from metrics import REDIS_LATENCY
+from redis.asyncio import ConnectionPool, Redis
+from redis.asyncio.client import PubSub
+from settings import config
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    AsyncSession,
+    async_sessionmaker,
+    create_async_engine,
+)
+
+
+logger = logging.getLogger(__name__)
+
+RESUBSCRIBE_DELAY = 1.0
+RESUBSCRIBE_MAX_DELAY = 30.0
+
+
+def make_async_engine() -> AsyncEngine:
+    return create_async_engine(
+        config.async_dsn,  # type: ignore[arg-type]
+        pool_size=config.DB_POOL_SIZE,
+        max_overflow=config.DB_MAX_OVERFLOW,
+        pool_pre_ping=config.DB_POOL_PRE_PING,
+        connect_args={
+            "prepared_statement_cache_size": config.DB_STATEMENT_CACHE_SIZE
+        },
+    )
+
+
+def make_session_maker(
+    engine: AsyncEngine,
+) -> async_sessionmaker[AsyncSession]:
+    return async_sessionmaker(engine, class_=AsyncSession)
+
+
+class MeasuredRedis(Redis):  # pylint:disable=W0223,R0901
+    async def execute_command(self, *args: Any, **options: Any) -> Any:
+        start = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            REDIS_LATENCY.labels(args[0]).observe(time.perf_counter() - start)
+
+
+def make_redis() -> Redis:
+    pool = ConnectionPool.from_url(
+        config.redis_url,  # type: ignore[arg-type]
+        max_connections=config.REDIS_MAX_CONNECTIONS,
+        socket_timeout=config.REDIS_SOCKET_TIMEOUT,
+        socket_connect_timeout=config.REDIS_CONNECT_TIMEOUT,
+        decode_responses=True,
+    )
+    return MeasuredRedis.from_pool(pool)
+
+
+async def subscription(
+    name: str,
+    channels: Sequence[str] = (),
+    patterns: Sequence[str] = (),
+    on_subscribe: Callable[[Redis], Awaitable[Any]] | None = None,
+) -> AsyncIterator[dict[str, Any]]:
+    """
+    Pub/sub messages on a connection of its own, resubscribed after any
+    error with a backoff from RESUBSCRIBE_DELAY up to RESUBSCRIBE_MAX_DELAY
+    seconds. `on_subscribe` runs on every (re)subscription, to catch up
+    with what was published meanwhile
+    """
+    delay = RESUBSCRIBE_DELAY
+    while True:
+        client = Redis.from_url(
+            config.redis_url,  # type: ignore[arg-type]
+            decode_responses=True,
+        )
+        try:
+            pubsub: PubSub
+            async with client.pubsub() as pubsub:
+                if channels:
+                    await pubsub.subscribe(*channels)
+                if patterns:
+                    await pubsub.psubscribe(*patterns)
+                if on_subscribe is not None:
+                    await on_subscribe(client)
+                delay = RESUBSCRIBE_DELAY
+                async for message in pubsub.listen():
+                    yield message
+        except (redis.ConnectionError, redis.TimeoutError) as err:
+            logger.warning("%s subscription lost: %s", name, err)
+        except Exception:  # pylint:disable=W0718
+            logger.exception("%s subscription failed", name)
+        finally:
+            await client.aclose()
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, RESUBSCRIBE_MAX_DELAY)
+
+
+async def warm_up(engine: AsyncEngine, connections: int) -> None:
+    """
+    Open `connections` pool connections concurrently, so the first
+    requests don't pay for the TCP and auth handshake
+    """
+
+    async def ping() -> None:
+        async with engine.connect() as connection:
+            await connection.execute(sa.text("SELECT 1"))
+
+    await asyncio.gather(*(ping() for _ in range(connections)))
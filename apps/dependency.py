@@ -1,19 +1,24 @@
-from typing import Annotated, AsyncIterator
+import math
+import time
+from typing import Annotated, AsyncIterator, Awaitable, Callable
 
+import jobs
 import jwt
-import models
+import limits
 import schemas
+from cache import user_cache
 from crud import get_user
-from fastapi import Depends, security, status
+from fastapi import Depends, Request, security, status
 from fastapi.exceptions import HTTPException
 from jwt.exceptions import InvalidTokenError
+from redis.asyncio import Redis
 from settings import config
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.ext.asyncio import AsyncSession
+from tag_catalog import TagCatalog
 
 
-async def get_async_session() -> AsyncIterator[AsyncSession]:
-    # pylint: disable=C0301
-    async with AsyncSession(create_async_engine(config.async_dsn)) as session:  # type: ignore
+async def get_async_session(request: Request) -> AsyncIterator[AsyncSession]:
+    async with request.app.state.async_session() as session:
         yield session
 
 
@@ -22,32 +27,106 @@ AsyncSessionDepency = Annotated[
 ]
 
 
+async def get_redis(request: Request) -> Redis:
+    return request.app.state.redis
+
+
+RedisDepency = Annotated[Redis, Depends(get_redis)]
+
+
+async def get_tag_catalog(request: Request) -> TagCatalog:
+    return request.app.state.tag_catalog
+
+
+TagCatalogDepency = Annotated[TagCatalog, Depends(get_tag_catalog)]
+
+
+def token_email(token: str) -> str | None:
+    """
+    Email of a valid access token, None for an invalid one. Decoded
+    tokens are cached until they expire
+    """
+    email = user_cache.tokens.get(token)
+    if email is not None:
+        return email
+    try:
+        payload = jwt.decode(
+            token, config.SECRET_KEY, algorithms=[config.ALGORITHM]
+        )
+    except InvalidTokenError:
+        return None
+    email = payload.get("user_email")
+    if email is not None:
+        user_cache.tokens.set(
+            token, email, payload.get("exp", float("inf")) - time.time()
+        )
+    return email
+
+
 async def get_current_user(
     token: Annotated[
         security.HTTPAuthorizationCredentials, Depends(security.HTTPBearer())
     ],
     session: AsyncSessionDepency,
-) -> models.User:
+) -> schemas.UserResponse:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(
-            token.credentials,
-            config.SECRET_KEY,
-            algorithms=[config.ALGORITHM],
-        )
-        email: str = payload.get("user_email")
-        if email is None:
-            raise credentials_exception
-    except InvalidTokenError as err:
-        raise credentials_exception from err
-    user = await get_user(session, email)
-    if user is None:
+    email = token_email(token.credentials)
+    if email is None:
         raise credentials_exception
+    user = await user_cache.get(email)
+    if user is None:
+        db_user = await get_user(session, email)
+        if db_user is None:
+            raise credentials_exception
+        user = schemas.UserResponse.model_validate(db_user)
+        await user_cache.set(user)
     return user
 
 
 GetCurrentUser = Annotated[schemas.UserResponse, Depends(get_current_user)]
+
+
+async def too_many_requests(
+    redis: Redis, scope: str, owner: str
+) -> HTTPException | None:
+    """
+    Token bucket per user and `scope`: <SCOPE>_RATE requests per second
+    with bursts of up to <SCOPE>_BURST, read from the config per request
+    """
+    rate = getattr(config, f"{scope.upper()}_RATE")
+    burst = getattr(config, f"{scope.upper()}_BURST")
+    retry_after = await limits.take_token(redis, scope, owner, rate, burst)
+    if not retry_after:
+        return None
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="Too many requests",
+        headers={"Retry-After": str(math.ceil(retry_after))},
+    )
+
+
+def rate_limit(scope: str) -> Callable[..., Awaitable[None]]:
+    async def check_rate(redis: RedisDepency, user: GetCurrentUser) -> None:
+        error = await too_many_requests(redis, scope, user.email)
+        if error is not None:
+            raise error
+
+    return check_rate
+
+
+async def queue_full(redis: Redis) -> HTTPException | None:
+    """
+    Shed uploads while the conversion queue is over its limits
+    """
+    count, size = await jobs.pending(redis)
+    if count < config.MAX_PENDING_JOBS and size < config.MAX_PENDING_BYTES:
+        return None
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Conversion queue is full",
+        headers={"Retry-After": str(config.SHED_RETRY_AFTER)},
+    )
@@ -0,0 +1,70 @@
+import io
+from typing import Any
+
+from PIL import Image
+
+
+ORIGINAL = "original"
+
+
+def supported(format_: str) -> bool:
+    """
+    AVIF needs Pillow >= 11.2 or the pillow-avif-plugin
+    """
+    Image.init()
+    return format_ == ORIGINAL or format_.upper() in Image.SAVE
+
+
+def save_options(
+    format_: str, quality: int | None = None, effort: int | None = None
+) -> dict[str, Any]:
+    """
+    Encoder settings. `effort` goes from 0 (fast) to 6 (smallest file)
+    """
+    options: dict[str, Any] = {}
+    if quality is not None:
+        options["quality"] = quality
+    if format_ == "jpeg":
+        options.update(optimize=True, progressive=True)
+    elif format_ == "webp" and effort is not None:
+        options["method"] = effort
+    elif format_ == "avif" and effort is not None:
+        options["speed"] = 6 - effort
+    return options
+
+
+def prepare(image: Image.Image, format_: str) -> Image.Image:
+    """
+    Convert to a mode the encoder accepts, alpha is dropped for JPEG
+    """
+    if format_ == "jpeg":
+        modes: tuple[str, ...] = ("L", "RGB")
+    else:
+        modes = ("RGB", "RGBA")
+    if format_ == ORIGINAL or image.mode in modes:
+        return image
+    has_alpha = "A" in image.mode or "transparency" in image.info
+    return image.convert("RGBA" if has_alpha and "RGBA" in modes else "RGB")
+
+
+def encode(
+    image: Image.Image,
+    source_format: str | None,
+    format_: str = ORIGINAL,
+    quality: int | None = None,
+    effort: int | None = None,
+) -> tuple[bytes, str]:
+    """
+    Encoded `image` and its file suffix, the original's format is kept
+    with Pillow's default settings
+    """
+    buffer = io.BytesIO()
+    if format_ == ORIGINAL:
+        image.save(buffer, format=source_format)
+        return buffer.getvalue(), str(source_format)
+    prepare(image, format_).save(
+        buffer,
+        format=format_.upper(),
+        **save_options(format_, quality, effort),
+    )
+    return buffer.getvalue(), format_
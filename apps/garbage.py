@@ -0,0 +1,75 @@
+import asyncio
+import logging
+import shutil
+from pathlib import Path
+
+from starlette.concurrency import run_in_threadpool
+
+
+logger = logging.getLogger(__name__)
+
+
+def remove(path: Path) -> tuple[int, int]:
+    """
+    Unlink a file or a directory tree. Returns the number of removed files
+    and the bytes freed: a file hard-linked from another upload frees
+    nothing until its last link is gone
+    """
+    if path.is_dir():
+        files = [p for p in path.rglob("*") if not p.is_dir()]
+    else:
+        files = [path]
+    removed = reclaimed = 0
+    for file in files:
+        try:
+            stat = file.lstat()
+            file.unlink()
+        except FileNotFoundError:
+            continue
+        removed += 1
+        if stat.st_nlink == 1:
+            reclaimed += stat.st_size
+    if path.is_dir():
+        shutil.rmtree(path, ignore_errors=True)
+    return removed, reclaimed
+
+
+class GarbageCollector:
+    """
+    Removes files of deleted images off the request path, one path at a
+    time in the threadpool. Paths queued before `stop` are still removed
+    """
+
+    def __init__(self) -> None:
+        self._queue: asyncio.Queue[Path | None] = asyncio.Queue()
+        self._task: asyncio.Task | None = None
+        self.removed = 0
+        self.reclaimed = 0
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._collect())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._queue.put_nowait(None)
+            await self._task
+
+    def collect(self, path: str | Path) -> None:
+        self._queue.put_nowait(Path(path))
+
+    async def _collect(self) -> None:
+        while (path := await self._queue.get()) is not None:
+            try:
+                removed, reclaimed = await run_in_threadpool(remove, path)
+            except OSError as err:
+                logger.warning("Can't remove %s: %s", path, err)
+                continue
+            self.removed += removed
+            self.reclaimed += reclaimed
+            logger.info(
+                "Removed %s: %d files, %d bytes reclaimed (%d in total)",
+                path,
+                removed,
+                reclaimed,
+                self.reclaimed,
+            )
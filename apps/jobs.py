@@ -0,0 +1,265 @@
+import asyncio
+import json
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator
+
+import limits
+import redis
+from database import subscription
+from redis import asyncio as aioredis
+from settings import config
+
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+FINAL = (DONE, FAILED)
+
+
+# Count a rendered variant, unless the job already has its final status.
+# Returns 1 when counted
+VARIANT_DONE = """
+local status = redis.call("HGET", KEYS[1], "status")
+if not status or status == "done" or status == "failed" then
+    return 0
+end
+redis.call("HSET", KEYS[1], "variant:" .. ARGV[1], "done", "status", "running")
+redis.call("HINCRBY", KEYS[1], "done", 1)
+return 1
+"""
+
+# Set the final status ARGV[1] and count it in the job's batch, keys
+# prefixed by ARGV[3]. Returns 0 when the job was already final, so that
+# concurrent failures are counted once
+FINISH = """
+local status = redis.call("HGET", KEYS[1], "status")
+if status == "done" or status == "failed" then
+    return 0
+end
+if not status then
+    return 1
+end
+redis.call("HSET", KEYS[1], "status", ARGV[1])
+if ARGV[2] ~= "" then
+    redis.call("HSET", KEYS[1], "variant:" .. ARGV[2], ARGV[1])
+end
+local batch = redis.call("HGET", KEYS[1], "batch")
+if batch and batch ~= "" then
+    redis.call("HINCRBY", ARGV[3] .. batch, ARGV[1], 1)
+end
+return 1
+"""
+
+
+def key(job_id: str) -> str:
+    return f"job:{job_id}"
+
+
+def batch_key(batch_id: str) -> str:
+    return f"batch:{batch_id}"
+
+
+def channel(job_id: str) -> str:
+    return f"jobs:{job_id}"
+
+
+def snapshot(job_id: str, data: Any) -> dict[str, Any]:
+    data = {
+        (k.decode() if isinstance(k, bytes) else k): (
+            v.decode() if isinstance(v, bytes) else v
+        )
+        for k, v in data.items()
+    }
+    return {
+        "job_id": job_id,
+        "status": data["status"],
+        "total": int(data["total"]),
+        "done": int(data["done"]),
+        "variants": {
+            field.removeprefix("variant:"): value
+            for field, value in data.items()
+            if field.startswith("variant:")
+        },
+    }
+
+
+async def create(  # pylint:disable=R0913
+    redis_client: aioredis.Redis,
+    job_id: str,
+    owner: str,
+    variants: list[str],
+    done: list[str],
+    *,
+    batch_id: str | None = None,
+    size: int = 0,
+) -> None:
+    """
+    Register a job, `done` variants are reused and don't need a render.
+    A queued job counts with the `size` of its original for admission
+    control until it finishes
+    """
+    status = DONE if not variants else QUEUED
+    mapping = {
+        "owner": owner,
+        "batch": batch_id or "",
+        "status": status,
+        "total": len(variants) + len(done),
+        "done": len(done),
+        **{f"variant:{variant}": QUEUED for variant in variants},
+        **{f"variant:{variant}": DONE for variant in done},
+    }
+    async with redis_client.pipeline() as pipe:
+        pipe.hset(key(job_id), mapping=mapping)  # type: ignore[arg-type]
+        pipe.expire(key(job_id), config.JOB_TTL)
+        if batch_id is not None and status == DONE:
+            pipe.hincrby(batch_key(batch_id), DONE, 1)
+        if status == QUEUED:
+            limits.add_pending(pipe, job_id, size)
+        await pipe.execute()
+
+
+async def create_batch(
+    redis_client: aioredis.Redis, batch_id: str, owner: str, total: int
+) -> None:
+    mapping = {"owner": owner, "total": total, DONE: 0, FAILED: 0}
+    async with redis_client.pipeline() as pipe:
+        pipe.hset(batch_key(batch_id), mapping=mapping)  # type: ignore
+        pipe.expire(batch_key(batch_id), config.JOB_TTL)
+        await pipe.execute()
+
+
+async def fail_in_batch(
+    redis_client: aioredis.Redis, batch_id: str, count: int
+) -> None:
+    """
+    Count `count` images of the batch that never got a job as failed
+    """
+    await redis_client.hincrby(  # type: ignore[misc]
+        batch_key(batch_id), FAILED, count
+    )
+
+
+async def pending(redis_client: aioredis.Redis) -> tuple[int, int]:
+    """
+    Number of queued jobs and bytes of their originals. Jobs past their
+    pending deadline were lost to a hard time limit or a dead worker, so
+    they are failed first: their status, events and batch end as well
+    """
+    script = redis_client.register_script(FINISH)
+    for job_id in await limits.overdue(redis_client):
+        if await script(keys=[key(job_id)], args=[FAILED, "", batch_key("")]):
+            data = await redis_client.hgetall(key(job_id))  # type: ignore
+            if data:
+                await redis_client.publish(
+                    channel(job_id), json.dumps(snapshot(job_id, data))
+                )
+    return await limits.pending(redis_client)
+
+
+async def get_batch(
+    redis_client: aioredis.Redis, batch_id: str
+) -> dict[str, Any] | None:
+    data = await redis_client.hgetall(batch_key(batch_id))  # type: ignore
+    if not data:
+        return None
+    if sum(int(data[k]) for k in (DONE, FAILED)) < int(data["total"]):
+        await pending(redis_client)
+        data = await redis_client.hgetall(batch_key(batch_id))  # type: ignore
+    total, done, failed = (int(data[k]) for k in ("total", DONE, FAILED))
+    return {
+        "owner": data["owner"],
+        "batch_id": batch_id,
+        "status": RUNNING if done + failed < total else DONE,
+        "total": total,
+        "done": done,
+        "failed": failed,
+    }
+
+
+async def get(
+    redis_client: aioredis.Redis, job_id: str
+) -> dict[str, Any] | None:
+    data = await redis_client.hgetall(key(job_id))  # type: ignore[misc]
+    if not data:
+        return None
+    if data["status"] not in FINAL:
+        await pending(redis_client)
+        data = await redis_client.hgetall(key(job_id))  # type: ignore
+    return {"owner": data["owner"], **snapshot(job_id, data)}
+
+
+def _publish(redis_client: redis.Redis, job_id: str) -> None:
+    data = redis_client.hgetall(key(job_id))
+    if data:
+        redis_client.publish(
+            channel(job_id), json.dumps(snapshot(job_id, data))
+        )
+
+
+def variant_done(redis_client: redis.Redis, job_id: str, variant: str):
+    script = redis_client.register_script(VARIANT_DONE)
+    if script(keys=[key(job_id)], args=[variant]):
+        _publish(redis_client, job_id)
+
+
+def finish(
+    redis_client: redis.Redis,
+    job_id: str,
+    status: str = DONE,
+    variant: str | None = None,
+):
+    """
+    Set the final `status` once, a failed `variant` is marked as well
+    """
+    script = redis_client.register_script(FINISH)
+    if not script(
+        keys=[key(job_id)], args=[status, variant or "", batch_key("")]
+    ):
+        return
+    limits.release(redis_client, job_id)
+    _publish(redis_client, job_id)
+
+
+class JobEvents:
+    """
+    One Redis pattern subscription per process for all jobs. Messages are
+    fanned out to the waiting clients through asyncio queues, so waiting
+    costs neither a Redis connection nor a DB query per client
+    """
+
+    def __init__(self) -> None:
+        self._queues: dict[str, set[asyncio.Queue[str]]] = defaultdict(set)
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._listen())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def _listen(self) -> None:
+        async for message in subscription(
+            "Job events", patterns=[channel("*")]
+        ):
+            if message["type"] == "pmessage":
+                self._dispatch(message["channel"], message["data"])
+
+    def _dispatch(self, job_channel: str, data: str) -> None:
+        job_id = job_channel.removeprefix(channel(""))
+        for queue in self._queues.get(job_id, ()):
+            queue.put_nowait(data)
+
+    @asynccontextmanager
+    async def subscribe(self, job_id: str) -> AsyncIterator[asyncio.Queue]:
+        queue: asyncio.Queue[str] = asyncio.Queue()
+        self._queues[job_id].add(queue)
+        try:
+            yield queue
+        finally:
+            self._queues[job_id].discard(queue)
+            if not self._queues[job_id]:
+                del self._queues[job_id]
@@ -0,0 +1,114 @@
+import time
+
+import redis
+from redis import asyncio as aioredis
+from settings import config
+
+
+PENDING_JOBS = "pending:jobs"
+PENDING_SIZES = "pending:sizes"
+PENDING_BYTES = "pending:bytes"
+
+# Refill by the elapsed time, then take `cost` tokens if there are enough.
+# Returns 1 and 0 when allowed, 0 and seconds to wait otherwise
+TOKEN_BUCKET = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local now = tonumber(ARGV[4])
+local bucket = redis.call("HMGET", KEYS[1], "tokens", "ts")
+local tokens = tonumber(bucket[1]) or burst
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(now - ts, 0) * rate)
+local allowed, retry_after = 0, (cost - tokens) / rate
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed, retry_after = 1, 0
+end
+redis.call("HSET", KEYS[1], "tokens", tostring(tokens), "ts", tostring(now))
+redis.call("PEXPIRE", KEYS[1], math.ceil(burst / rate * 1000))
+return {allowed, tostring(retry_after)}
+"""
+
+# Drop pending jobs from the counters. With ARGV[1] only that job, else
+# the ones past their deadline (lost to a killed worker) and then return
+# the number of pending jobs and their bytes
+RELEASE = """
+local jobs = {ARGV[1]}
+if ARGV[1] == "" then
+    jobs = redis.call("ZRANGEBYSCORE", KEYS[1], "-inf", ARGV[2])
+end
+for _, job in ipairs(jobs) do
+    if redis.call("ZREM", KEYS[1], job) == 1 then
+        local size = tonumber(redis.call("HGET", KEYS[2], job)) or 0
+        redis.call("HDEL", KEYS[2], job)
+        redis.call("DECRBY", KEYS[3], size)
+    end
+end
+return {redis.call("ZCARD", KEYS[1]), tonumber(redis.call("GET", KEYS[3])) or 0}
+"""
+
+
+def bucket_key(scope: str, owner: str) -> str:
+    return f"rate:{scope}:{owner}"
+
+
+async def take_token(  # pylint:disable=R0913
+    redis_client: aioredis.Redis,
+    scope: str,
+    owner: str,
+    rate: float,
+    burst: int,
+    *,
+    cost: int = 1,
+) -> float:
+    """
+    Seconds to wait before `cost` tokens are available, 0 when they are
+    taken
+    """
+    script = redis_client.register_script(TOKEN_BUCKET)
+    allowed, retry_after = await script(
+        keys=[bucket_key(scope, owner)],
+        args=[rate, burst, cost, time.time()],
+    )
+    return 0.0 if int(allowed) else float(retry_after)
+
+
+def add_pending(
+    pipe: aioredis.client.Pipeline, job_id: str, size: int
+) -> None:
+    """
+    Count a queued job and its original's bytes until `release`. The
+    deadline drops jobs that will never finish
+    """
+    deadline = time.time() + config.PENDING_TTL
+    pipe.zadd(PENDING_JOBS, {job_id: deadline})
+    pipe.hset(PENDING_SIZES, job_id, str(size))
+    pipe.incrby(PENDING_BYTES, size)
+
+
+async def overdue(redis_client: aioredis.Redis) -> list[str]:
+    """
+    Pending jobs past their deadline
+    """
+    job_ids = await redis_client.zrangebyscore(
+        PENDING_JOBS, "-inf", time.time()
+    )
+    return [
+        job_id.decode() if isinstance(job_id, bytes) else job_id
+        for job_id in job_ids
+    ]
+
+
+async def pending(redis_client: aioredis.Redis) -> tuple[int, int]:
+    script = redis_client.register_script(RELEASE)
+    jobs, size = await script(
+        keys=[PENDING_JOBS, PENDING_SIZES, PENDING_BYTES],
+        args=["", time.time()],
+    )
+    return int(jobs), int(size)
+
+
+def release(redis_client: redis.Redis, job_id: str) -> None:
+    script = redis_client.register_script(RELEASE)
+    script(keys=[PENDING_JOBS, PENDING_SIZES, PENDING_BYTES], args=[job_id])
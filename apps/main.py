@@ -1,8 +1,20 @@
 from contextlib import asynccontextmanager
 
+import tracing
+from admission import AdmissionMiddleware
+from body_limit import BodyLimitMiddleware
+from cache import user_cache
+from database import make_async_engine, make_redis, make_session_maker, warm_up
 from fastapi import FastAPI
-from fastapi.staticfiles import StaticFiles
+from garbage import GarbageCollector
+from jobs import JobEvents
+from metrics import MetricsMiddleware, StateCollector, metrics_router
+from prometheus_client import REGISTRY
+from render_cache import RenderCache
 from settings import config
+from starlette.concurrency import run_in_threadpool
+from static import MediaStaticFiles
+from tag_catalog import TagCatalog
 
 from api import image_router, tags_router, user_router
 
@@ -11,14 +23,48 @@ from api import image_router, tags_router, user_router
 async def lifespan(application: FastAPI):
     config.MEDIA_DIR.mkdir(exist_ok=True)
     application.mount(
-        "/media", StaticFiles(directory=config.MEDIA_DIR), name="media"
+        "/media", MediaStaticFiles(directory=config.MEDIA_DIR), name="media"
     )
+    application.state.render_cache = RenderCache(
+        config.MEDIA_DIR / "cache", config.RENDER_CACHE_MAX_BYTES
+    )
+    await run_in_threadpool(application.state.render_cache.load)
+    engine = make_async_engine()
+    application.state.async_session = make_session_maker(engine)
+    await warm_up(engine, config.DB_POOL_SIZE)
+    application.state.redis = make_redis()
+    application.state.job_events = JobEvents()
+    application.state.job_events.start()
+    application.state.garbage = GarbageCollector()
+    application.state.garbage.start()
+    collector = StateCollector(engine, application.state.garbage)
+    REGISTRY.register(collector)
+    application.state.tag_catalog = TagCatalog(
+        application.state.async_session, application.state.redis
+    )
+    await application.state.tag_catalog.load()
+    application.state.tag_catalog.start()
+    if config.USER_CACHE_REDIS:
+        user_cache.redis = application.state.redis
 
     yield
 
+    REGISTRY.unregister(collector)
+    user_cache.redis = None
+    await application.state.garbage.stop()
+    await application.state.tag_catalog.stop()
+    await application.state.job_events.stop()
+    await application.state.redis.aclose()
+    await engine.dispose()
+
 
 app = FastAPI(lifespan=lifespan)
+app.add_middleware(BodyLimitMiddleware)
+app.add_middleware(AdmissionMiddleware)
+app.add_middleware(MetricsMiddleware)
+tracing.instrument_app(app)
 
 app.include_router(image_router)
 app.include_router(user_router)
 app.include_router(tags_router)
+app.include_router(metrics_router)
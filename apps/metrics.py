@@ -0,0 +1,162 @@
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+import tracing
+from cache import user_cache
+from fastapi import APIRouter, Response
+from garbage import GarbageCollector
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from prometheus_client.registry import Collector
+from sqlalchemy.ext.asyncio import AsyncEngine
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Time to the response start, by route template",
+    ["method", "route", "status"],
+)
+REDIS_LATENCY = Histogram(
+    "redis_command_duration_seconds",
+    "Redis round trip of the API process",
+    ["command"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5),
+)
+CONVERT_STAGE = Histogram(
+    "convert_stage_duration_seconds",
+    "Image conversion by stage: decode, resize, encode, write, db",
+    ["stage"],
+)
+CONVERT_PEAK_RSS = Histogram(
+    "convert_peak_rss_bytes",
+    "Peak resident memory of the worker process during a conversion",
+    buckets=tuple(2**power * 1024 * 1024 for power in range(5, 14)),
+)
+
+metrics_router = APIRouter(tags=["metrics"])
+
+
+@metrics_router.get("/metrics", include_in_schema=False)
+async def get_metrics() -> Response:
+    return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    with tracing.span(name):
+        start = time.perf_counter()
+        yield
+        CONVERT_STAGE.labels(name).observe(time.perf_counter() - start)
+
+
+def reset_peak_rss() -> None:
+    """
+    Writing 5 to clear_refs resets VmHWM (Linux 4.0+)
+    """
+    try:
+        with open("/proc/self/clear_refs", "w", encoding="ascii") as file:
+            file.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss() -> int | None:
+    try:
+        with open("/proc/self/status", encoding="ascii") as file:
+            for line in file:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+@contextmanager
+def track_peak_rss() -> Iterator[None]:
+    """
+    Per task with the prefork pool, where a process runs one task at a
+    time
+    """
+    reset_peak_rss()
+    try:
+        yield
+    finally:
+        if (peak := peak_rss()) is not None:
+            CONVERT_PEAK_RSS.observe(peak)
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI, so streaming responses aren't buffered. Routes are labelled
+    by their template, mounted apps by their mount path
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = 500
+
+        async def send_status(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            route = getattr(scope.get("route"), "path", None)
+            REQUEST_LATENCY.labels(
+                scope["method"],
+                route or scope.get("root_path") or "unmatched",
+                status,
+            ).observe(time.perf_counter() - start)
+
+
+class StateCollector(Collector):
+    """
+    Values read at scrape time: DB pool, user cache and garbage collector
+    """
+
+    def __init__(self, engine: AsyncEngine, garbage: GarbageCollector):
+        self.pool = engine.sync_engine.pool
+        self.garbage = garbage
+
+    def collect(self):
+        for name, value in (
+            ("size", self.pool.size()),  # type:ignore[attr-defined]
+            ("checked_in", self.pool.checkedin()),  # type:ignore
+            ("checked_out", self.pool.checkedout()),  # type:ignore
+            ("overflow", self.pool.overflow()),  # type:ignore
+        ):
+            yield GaugeMetricFamily(
+                f"db_pool_{name}", f"DB pool connections: {name}", value
+            )
+        cache = CounterMetricFamily(
+            "user_cache", "Current user cache lookups", labels=["result"]
+        )
+        for name, value in user_cache.stats().items():
+            cache.add_metric([name], value)
+        yield cache
+        yield CounterMetricFamily(
+            "garbage_removed_files",
+            "Files of deleted images removed",
+            self.garbage.removed,
+        )
+        yield CounterMetricFamily(
+            "garbage_reclaimed_bytes",
+            "Disk space reclaimed from deleted images",
+            self.garbage.reclaimed,
+        )
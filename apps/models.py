@@ -1,6 +1,6 @@
-import uuid
 from datetime import datetime
 from typing import Type, TypeVar
+from uuid import UUID
 
 import sqlalchemy as sa
 from sqlalchemy import Column, ForeignKey, MetaData, Table
@@ -27,8 +27,15 @@ TypeModel = Type[MODEL]
 image_tags = Table(
     "image_tags",
     Base.metadata,
-    Column("image_id", ForeignKey("images.id", ondelete="CASCADE")),
-    Column("tag_id", ForeignKey("tags.id", ondelete="CASCADE")),
+    Column(
+        "image_id",
+        ForeignKey("images.id", ondelete="CASCADE"),
+        primary_key=True,
+    ),
+    Column(
+        "tag_id", ForeignKey("tags.id", ondelete="CASCADE"), primary_key=True
+    ),
+    sa.Index("ix_image_tags_tag_id_image_id", "tag_id", "image_id"),
 )
 
 
@@ -43,6 +50,7 @@ class User(Base):
 
 class Image(Base):
     __tablename__ = "images"
+    __table_args__ = (sa.Index("ix_images_data_id", "data", "id"),)
     # pylint:disable=E1136
     id: Mapped[int] = mapped_column(primary_key=True)
     title: Mapped[str]
@@ -51,7 +59,7 @@ class Image(Base):
     data: Mapped[datetime] = mapped_column(server_default=sa.func.now())
     resolution: Mapped[str]
     size: Mapped[int]
-    uuid: Mapped[uuid.UUID]
+    uuid: Mapped[UUID] = mapped_column(index=True)
     tags: Mapped[list["Tag"]] = relationship(
         secondary=image_tags, lazy="selectin", cascade="all, delete"
     )
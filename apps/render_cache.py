@@ -0,0 +1,93 @@
+import asyncio
+import os
+from collections import Counter, OrderedDict
+from pathlib import Path
+from typing import Callable
+from uuid import uuid4
+
+from starlette.concurrency import run_in_threadpool
+
+
+class RenderCache:
+    """
+    Size-bounded LRU cache of rendered files in `directory`. Concurrent
+    misses of the same file share one render. A file is pinned from `get`
+    until `release`, so it isn't evicted while it is being sent
+    """
+
+    def __init__(self, directory: Path, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._files: OrderedDict[str, int] = OrderedDict()
+        self._renders: dict[str, asyncio.Future[Path]] = {}
+        self._pins: Counter[str] = Counter()
+
+    def load(self) -> None:
+        """
+        Pick up files left by the previous run, least recently used first
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        files = []
+        for path in self.directory.iterdir():
+            if path.name.startswith("."):
+                path.unlink(missing_ok=True)
+                continue
+            files.append((path.stat(), path.name))
+        for stat, name in sorted(files, key=lambda item: item[0].st_atime):
+            self._add(name, stat.st_size)
+
+    async def get(self, name: str, render: Callable[[Path], None]) -> Path:
+        """
+        Path of the cached file `name`, `render(path)` writes it on a miss
+        """
+        path = self.directory / name
+        if name in self._files:
+            self._files.move_to_end(name)
+            self._pins[name] += 1
+            return path
+        future = self._renders.get(name)
+        if future is None:
+            future = asyncio.ensure_future(self._render(name, render))
+            self._renders[name] = future
+            future.add_done_callback(lambda _: self._renders.pop(name))
+        path = await asyncio.shield(future)
+        self._pins[name] += 1
+        return path
+
+    def release(self, name: str) -> None:
+        self._pins[name] -= 1
+        if self._pins[name] <= 0:
+            del self._pins[name]
+
+    async def _render(self, name: str, render: Callable[[Path], None]) -> Path:
+        path = self.directory / name
+        tmp_path = self.directory / f".{uuid4().hex}{path.suffix}"
+        try:
+            await run_in_threadpool(render, tmp_path)
+            await run_in_threadpool(os.replace, tmp_path, path)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+        self._add(name, path.stat().st_size)
+        return path
+
+    def _add(self, name: str, size: int) -> None:
+        self._files[name] = size
+        self.size += size
+        for old_name in list(self._files):
+            if self.size <= self.max_bytes:
+                break
+            if old_name == name or old_name in self._pins:
+                continue
+            self.size -= self._files.pop(old_name)
+            (self.directory / old_name).unlink(missing_ok=True)
+
+    def evict(self, prefix: str) -> list[Path]:
+        """
+        Forget the files whose name starts with `prefix`, returns their
+        paths for the caller to remove
+        """
+        names = [name for name in self._files if name.startswith(prefix)]
+        for name in names:
+            self.size -= self._files.pop(name)
+        return [self.directory / name for name in names]
@@ -1,11 +1,14 @@
 import re
 from dataclasses import dataclass
-from datetime import datetime
+from datetime import datetime, timezone
+from enum import StrEnum
 from typing import Annotated
+from uuid import UUID
 
-from fastapi import Form
-from pydantic import BaseModel, ConfigDict, EmailStr
+from fastapi import Form, Query
+from pydantic import BaseModel, ConfigDict, EmailStr, TypeAdapter
 from pydantic.functional_validators import AfterValidator
+from settings import config
 
 
 def check_password(password: str) -> str:
@@ -19,6 +22,35 @@ def check_password(password: str) -> str:
 Password = Annotated[str, AfterValidator(check_password)]
 
 
+def to_naive_utc(value: datetime) -> datetime:
+    if value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+NaiveDatetime = Annotated[datetime, AfterValidator(to_naive_utc)]
+
+
+def check_resolution(resolution: str) -> str:
+    """
+    `WxH` with both sides up to RENDER_MAX_SIZE, so that a requested
+    variant can't make the worker allocate more than a render does
+    """
+    match = re.fullmatch(r"(\d+)x(\d+)", resolution)
+    if match is None:
+        raise ValueError("Resolution must look like WIDTHxHEIGHT")
+    if not all(
+        0 < int(side) <= config.RENDER_MAX_SIZE for side in match.groups()
+    ):
+        raise ValueError(
+            f"Resolution sides must be from 1 to {config.RENDER_MAX_SIZE}"
+        )
+    return resolution
+
+
+Resolution = Annotated[str, AfterValidator(check_resolution)]
+
+
 class Token(BaseModel):
     token: str
 
@@ -63,10 +95,42 @@ class Image(BaseModel):
     size: int
 
 
+class Resample(StrEnum):
+    nearest = "nearest"
+    box = "box"
+    bilinear = "bilinear"
+    hamming = "hamming"
+    bicubic = "bicubic"
+    lanczos = "lanczos"
+
+
+class ImageFormat(StrEnum):
+    original = "original"
+    jpeg = "jpeg"
+    webp = "webp"
+    avif = "avif"
+
+
+class RenderMode(StrEnum):
+    RGB = "RGB"
+    L = "L"
+
+
+@dataclass
+class ImageRender:
+    w: int = Query(..., gt=0, le=config.RENDER_MAX_SIZE)
+    h: int = Query(..., gt=0, le=config.RENDER_MAX_SIZE)
+    mode: RenderMode | None = Query(None)
+
+
 @dataclass
 class ImageCreate:
-    resolutions: list[str] = Form(...)
+    resolutions: list[Resolution] = Form(...)
     tags: list[int] = Form(...)
+    resample: Resample = Form(Resample.bicubic)
+    format: ImageFormat = Form(ImageFormat.original)
+    quality: int | None = Form(None, ge=1, le=100)
+    effort: int | None = Form(None, ge=0, le=6)
 
 
 class ImageResponse(Image):
@@ -75,6 +139,68 @@ class ImageResponse(Image):
     model_config = ConfigDict(from_attributes=True)
 
 
+images_adapter = TypeAdapter(list[ImageResponse])
+
+
+class TagsMode(StrEnum):
+    add = "add"
+    set = "set"
+    delete = "delete"
+
+
 class ImageUpdate(BaseModel):
     title: str | None = None
     tags: list[int] | None = None
+    tags_mode: TagsMode = TagsMode.add
+
+
+class JobResponse(BaseModel):
+    job_id: str
+    status: str
+    total: int
+    done: int
+    variants: dict[str, str]
+
+
+class BatchResponse(BaseModel):
+    batch_id: str
+    status: str
+    total: int
+    done: int
+    failed: int
+
+
+class ImagePage(BaseModel):
+    items: list[ImageResponse]
+    next_cursor: str | None = None
+
+
+@dataclass
+class Pagination:
+    cursor: str | None = Query(None)
+    limit: int = Query(config.PAGE_SIZE, ge=1, le=config.MAX_PAGE_SIZE)
+
+
+class TagMatch(StrEnum):
+    any = "any"
+    all = "all"
+
+
+@dataclass
+class ImageFilter:
+    uuid: UUID | None = Query(None)
+    tags: list[int] | None = Query(None)
+    match: TagMatch = Query(TagMatch.any)
+    date_from: NaiveDatetime | None = Query(None)
+    date_to: NaiveDatetime | None = Query(None)
+
+
+@dataclass
+class ImageDelete:
+    ids: list[int] = Query(..., max_length=config.DELETE_MAX_IDS)
+
+
+@dataclass
+class ImageSearch:
+    tags: str = Query(..., pattern=r"^\d+(,\d+)*$", examples=["1,2"])
+    match: TagMatch = Query(TagMatch.any)
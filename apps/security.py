@@ -1,4 +1,7 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, TypeVar
 
 import bcrypt
 import jwt
@@ -10,19 +13,46 @@ from settings import config
 from sqlalchemy.ext.asyncio import AsyncSession
 
 
+T = TypeVar("T")
+
+# bcrypt releases the GIL, so hashing runs in parallel in these threads
+# while the event loop keeps serving other requests
+hasher = ThreadPoolExecutor(
+    max_workers=config.BCRYPT_MAX_WORKERS, thread_name_prefix="bcrypt"
+)
+
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return bcrypt.checkpw(plain_password.encode(), hashed_password.encode())
 
 
 def get_password_hash(password: str) -> str:
-    return bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
+    salt = bcrypt.gensalt(rounds=config.BCRYPT_ROUNDS)
+    return bcrypt.hashpw(password.encode(), salt).decode()
+
+
+async def run_in_hasher(func: Callable[..., T], *args: Any) -> T:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(hasher, func, *args)
+
+
+async def async_verify_password(
+    plain_password: str, hashed_password: str
+) -> bool:
+    return await run_in_hasher(
+        verify_password, plain_password, hashed_password
+    )
+
+
+async def async_get_password_hash(password: str) -> str:
+    return await run_in_hasher(get_password_hash, password)
 
 
 async def authenticate_user(
     session: AsyncSession, email: str, password: str
 ) -> models.User:
     user = await get_user(session, email)
-    if not user or not verify_password(password, user.password):
+    if not user or not await async_verify_password(password, user.password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -13,6 +13,15 @@ class Config(BaseSettings):
 
     ROOT_DIR: Path = Path(__file__).parent.resolve()
     MEDIA_DIR: Path = ROOT_DIR / "media"
+    MAX_UPLOAD_SIZE: int = 50 * 1024 * 1024
+    # the form fields and multipart headers on top of the files
+    MAX_FORM_SIZE: int = 64 * 1024
+    UPLOAD_CHUNK_SIZE: int = 1024 * 1024
+    PAGE_SIZE: int = 50
+    MAX_PAGE_SIZE: int = 200
+    DELETE_MAX_IDS: int = 1000
+    RENDER_CACHE_MAX_BYTES: int = 1024 * 1024 * 1024
+    RENDER_MAX_SIZE: int = 4096
 
     # RabbitMQ
     RABBIT_USER: str = "quest"
@@ -20,14 +29,51 @@ class Config(BaseSettings):
     RABBIT_HOST: str = "localhost"
     RABBIT_PORT: int = 6379
 
+    # Celery
+    CONVERT_FAN_OUT: bool = False
+    RESIZE_REDUCING_GAP: float | None = 3.0
+    IMAGE_PIXEL_BUDGET: int = 25_000_000
+    CONVERT_LARGE_COST: int = 50_000_000
+    CONVERT_SOFT_TIME_LIMIT: int = 300
+    CONVERT_TIME_LIMIT: int = 360
+
+    # Rate limits (requests per second and burst, per user) and load
+    # shedding on the conversions waiting in the queue
+    UPLOAD_RATE: float = 2.0
+    UPLOAD_BURST: int = 20
+    BATCH_RATE: float = 0.05
+    BATCH_BURST: int = 2
+    RENDER_RATE: float = 5.0
+    RENDER_BURST: int = 50
+    MAX_PENDING_JOBS: int = 5000
+    MAX_PENDING_BYTES: int = 20 * 1024 * 1024 * 1024
+    PENDING_TTL: int = 60 * 60
+    SHED_RETRY_AFTER: int = 30
+    JOB_TTL: int = 24 * 60 * 60
+    BATCH_MAX_FILES: int = 1000
+    BATCH_CHUNK_SIZE: int = 50
+    JOB_EVENTS_PING: float = 15.0
+    WORKER_METRICS_PORT: int | None = None
+
+    # Observability
+    TRACING: bool = False
+
     # Redis
     REDIS_HOST: str = "localhost"
     REDIS_PORT: int = 6379
+    REDIS_MAX_CONNECTIONS: int = 50
+    REDIS_SOCKET_TIMEOUT: float = 5.0
+    REDIS_CONNECT_TIMEOUT: float = 2.0
 
     # JWT token
     SECRET_KEY: str = ""
     ALGORITHM: str = ""
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 0
+    BCRYPT_ROUNDS: int = 12
+    BCRYPT_MAX_WORKERS: int = 4
+    USER_CACHE_SIZE: int = 10_000
+    USER_CACHE_TTL: int = 60
+    USER_CACHE_REDIS: bool = False
 
     # DB settings
     DB_USER: str = "postgres"
@@ -35,6 +81,10 @@ class Config(BaseSettings):
     DB_NAME: str = "db"
     DB_HOST: str = "localhost"
     DB_PORT: int = 5432
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_PRE_PING: bool = True
+    DB_STATEMENT_CACHE_SIZE: int = 100
 
     @computed_field
     def dsn(self) -> str:
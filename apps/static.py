@@ -0,0 +1,89 @@
+import hashlib
+import os
+from typing import Any, Callable
+
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Receive, Scope, Send
+
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+PATHSEND = "http.response.pathsend"
+
+
+class MediaFileResponse(FileResponse):
+    """
+    Stored file names contain a uuid, so the content behind a name never
+    changes: the response is cached forever, and the ETag is derived from
+    the name and the size only, so it is the same on every replica.
+    The body is sent with the ASGI pathsend extension (sendfile) when the
+    server supports it. `on_close` runs once the response is done with
+    the file, sent or not
+    """
+
+    def __init__(
+        self,
+        path: str | os.PathLike[str],
+        status_code: int = 200,
+        on_close: Callable[[], None] | None = None,
+        **kwargs: Any,
+    ):
+        headers = {"cache-control": IMMUTABLE, **kwargs.pop("headers", {})}
+        self.pathsend = False
+        self.on_close = on_close
+        super().__init__(
+            path, status_code=status_code, headers=headers, **kwargs
+        )
+
+    def set_stat_headers(self, stat_result: os.stat_result) -> None:
+        etag_base = f"{os.path.basename(self.path)}-{stat_result.st_size}"
+        etag = hashlib.sha1(etag_base.encode(), usedforsecurity=False)
+        self.headers.setdefault("etag", f'"{etag.hexdigest()}"')
+        super().set_stat_headers(stat_result)
+
+    # an instance method: the ETag it compares to is per response
+    def _should_use_range(  # type: ignore[override] # pylint:disable=W0221
+        self, http_if_range: str, stat_result: os.stat_result
+    ) -> bool:
+        return http_if_range in (
+            self.headers.get("etag"),
+            self.headers.get("last-modified"),
+        )
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        self.pathsend = PATHSEND in scope.get("extensions", {})
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            if self.on_close is not None:
+                self.on_close()
+
+    async def _handle_simple(self, send: Send, send_header_only: bool):
+        if send_header_only or not self.pathsend:
+            await super()._handle_simple(send, send_header_only)
+            return
+        await send(
+            {
+                "type": "http.response.start",
+                "status": self.status_code,
+                "headers": self.raw_headers,
+            }
+        )
+        await send({"type": PATHSEND, "path": str(self.path)})
+
+
+class MediaStaticFiles(StaticFiles):
+    def file_response(
+        self,
+        full_path: str | os.PathLike[str],
+        stat_result: os.stat_result,
+        scope: Scope,
+        status_code: int = 200,
+    ) -> Response:
+        response = MediaFileResponse(
+            full_path, status_code=status_code, stat_result=stat_result
+        )
+        if self.is_not_modified(response.headers, Headers(scope=scope)):
+            return NotModifiedResponse(response.headers)
+        return response
@@ -0,0 +1,104 @@
+import asyncio
+import logging
+from typing import Any, Iterable
+
+import sqlalchemy as sa
+from database import subscription
+from models import Tag
+from redis import asyncio as aioredis
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = "tags:version"
+CHANNEL = "tags:changed"
+
+
+async def bump(redis_client: aioredis.Redis) -> None:
+    """
+    Call after every committed tag change, so that every process reloads
+    """
+    version = await redis_client.incr(VERSION_KEY)
+    await redis_client.publish(CHANNEL, version)
+
+
+class TagCatalog:
+    """
+    Every tag by id, in process. Tags are few and rarely change: the
+    catalog is reloaded when a newer version is announced on CHANNEL, or
+    when asked for an id it doesn't know yet
+    """
+
+    def __init__(
+        self,
+        session_maker: async_sessionmaker[AsyncSession],
+        redis_client: aioredis.Redis,
+    ) -> None:
+        self._session_maker = session_maker
+        self._redis = redis_client
+        self._lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+        self.tags: dict[int, str] = {}
+        self.version = -1
+        self._loads = 0
+
+    async def load(self) -> None:
+        async with self._lock:
+            await self._load()
+
+    async def _load(self) -> None:
+        self._loads += 1
+        # the version is read first: a change committed after it is
+        # announced again and reloads the catalog once more
+        version = int(await self._redis.get(VERSION_KEY) or 0)
+        async with self._session_maker() as session:
+            result = await session.execute(sa.select(Tag.id, Tag.name))
+        self.tags = dict(result.tuples().all())
+        self.version = version
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._listen())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def _catch_up(self, client: aioredis.Redis) -> None:
+        # changes made while there was no subscription
+        if int(await client.get(VERSION_KEY) or 0) > self.version:
+            await self.load()
+
+    async def _listen(self) -> None:
+        async for message in subscription(
+            "Tag catalog", channels=[CHANNEL], on_subscribe=self._catch_up
+        ):
+            if message["type"] != "message":
+                continue
+            try:
+                if int(message["data"]) > self.version:
+                    await self.load()
+            except Exception:  # pylint:disable=W0718
+                # the next announcement or unknown id reloads again
+                logger.exception("Tag catalog reload failed")
+
+    async def known(self, tag_ids: Iterable[int]) -> list[int]:
+        """
+        The existing ones of `tag_ids`, reloading once for unknown ids
+        """
+        tag_ids = list(tag_ids)
+        if any(tag_id not in self.tags for tag_id in tag_ids):
+            loads = self._loads
+            async with self._lock:
+                # a reload started meanwhile sees what this one would
+                if self._loads == loads:
+                    await self._load()
+        return [tag_id for tag_id in tag_ids if tag_id in self.tags]
+
+    def resolve(self, tag_ids: Iterable[int]) -> list[dict[str, Any]]:
+        return [
+            {"id": tag_id, "name": self.tags[tag_id]}
+            for tag_id in tag_ids
+            if tag_id in self.tags
+        ]
@@ -1,10 +1,11 @@
 from pathlib import Path
 from shutil import rmtree
 from typing import AsyncIterator
+from uuid import uuid4
 
 import pytest
 from httpx import ASGITransport, AsyncClient
-from main import app
+from main import app, lifespan
 from settings import config
 
 
@@ -20,12 +21,20 @@ async def client_fixture() -> AsyncIterator[AsyncClient]:
     """
     # pylint: disable=C0301
 
-    async with AsyncClient(
+    async with lifespan(app), AsyncClient(
         transport=ASGITransport(app=app), base_url="http://test"  # type: ignore
     ) as ac:
         yield ac
 
 
+@pytest.fixture(name="headers")
+async def headers_fixture(client: AsyncClient) -> dict[str, str]:
+    user = {"email": f"{uuid4().hex}@test.com", "password": "password"}
+    await client.post("/users/", json=user)
+    response = await client.post("/users/login", json=user)
+    return {"Authorization": f"Bearer {response.json()['token']}"}
+
+
 @pytest.fixture
 def path_image() -> Path:
     return config.ROOT_DIR / "tests" / "test-image.jpg"
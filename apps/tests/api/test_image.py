@@ -1,8 +1,25 @@
+import asyncio
+from datetime import datetime
 from pathlib import Path
+from typing import Any, AsyncIterator
+from uuid import uuid4
 
+import celery_app
+import crud
+import dependency
+import encoders
+import models
 import pytest
+import sqlalchemy as sa
+import tag_catalog
+from cache import user_cache
 from fastapi import status
 from httpx import AsyncClient
+from main import app
+from security import get_password_hash
+from settings import config
+
+import api
 
 
 pytestmark = pytest.mark.anyio
@@ -20,6 +37,36 @@ async def test_create_image(client: AsyncClient, path_image: Path):
     assert response.status_code == status.HTTP_201_CREATED
 
 
+async def test_create_image_reuses_content(
+    client: AsyncClient,
+    path_image: Path,
+    headers: dict[str, str],
+    monkeypatch: pytest.MonkeyPatch,
+):
+    converted = []
+
+    def convert_now(dict_: dict[str, Any]) -> None:
+        converted.append(dict_["uuid"])
+        celery_app.convert(dict_)
+
+    monkeypatch.setattr(api, "convert_image", convert_now)
+    await client.post("/tags/", json={"name": "pop"})
+    data = {"resolutions": ["120x80"], "tags": [1]}
+    job_ids = []
+    for _ in range(2):
+        with open(path_image, "rb") as file:
+            response = await client.post(
+                "/images/", files={"image": file}, data=data, headers=headers
+            )
+        assert response.status_code == status.HTTP_201_CREATED
+        job_ids.append(response.json()["job_id"])
+    assert converted == job_ids[:1]
+
+    response = await client.get(f"/images/jobs/{job_ids[1]}", headers=headers)
+    assert response.json()["status"] == "done"
+    assert response.json()["done"] == response.json()["total"]
+
+
 async def test_update_image(client: AsyncClient, path_image: Path):
     response = await client.post("/tags/", json={"name": "dom"})
     await client.post("/tags/", json={"name": "maf"})
@@ -33,6 +80,54 @@ async def test_update_image(client: AsyncClient, path_image: Path):
     assert response.status_code == status.HTTP_200_OK
 
 
+@pytest.mark.parametrize(
+    "mode, update, expected",
+    [
+        ("add", [2, None], [0, 1, 2]),
+        ("set", [1, 2, None], [1, 2]),
+        ("set", [], []),
+        ("delete", [0, None], [1]),
+    ],
+)
+async def test_update_image_tags(  # pylint:disable=R0913,R0917
+    client: AsyncClient,
+    path_image: Path,
+    headers: dict[str, str],
+    monkeypatch: pytest.MonkeyPatch,
+    mode: str,
+    update: list[int | None],
+    expected: list[int],
+):
+    monkeypatch.setattr(api, "convert_image", celery_app.convert)
+    tag_ids = []
+    for _ in range(3):
+        response = await client.post("/tags/", json={"name": uuid4().hex})
+        tag_ids.append(response.json()["id"])
+    data = {"resolutions": ["90x60"], "tags": tag_ids[:2]}
+    with open(path_image, "rb") as file:
+        await client.post(
+            "/images/", files={"image": file}, data=data, headers=headers
+        )
+    response = await client.get("/images/result/", headers=headers)
+    image_id = response.json()[0]["id"]
+
+    # None stands for a tag id that doesn't exist
+    tags = [100500 if i is None else tag_ids[i] for i in update]
+    response = await client.patch(
+        f"/images/{image_id}/", json={"tags": tags, "tags_mode": mode}
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert [tag["id"] for tag in response.json()["tags"]] == [
+        tag_ids[i] for i in expected
+    ]
+
+
+async def test_update_image_not_found(client: AsyncClient):
+    update_data = {"tags": [1], "tags_mode": "set"}
+    response = await client.patch("/images/100500/", json=update_data)
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
 async def test_delete_image(client: AsyncClient, path_image: Path):
     await client.post("/tags/", json={"name": "pop"})
     data = {"resolutions": ["100x100", "500x500"], "tags": [1]}
@@ -41,3 +136,456 @@ async def test_delete_image(client: AsyncClient, path_image: Path):
 
     response = await client.delete("/images/1/")
     assert response.status_code == status.HTTP_200_OK
+
+
+async def test_delete_image_group(
+    client: AsyncClient, headers: dict[str, str]
+):
+    response = await client.delete(
+        f"/images/group/{uuid4()}/", headers=headers
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["deleted"] == 0
+
+    response = await client.delete(
+        "/images/", params={"ids": [1, 2]}, headers=headers
+    )
+    assert response.status_code == status.HTTP_200_OK
+
+
+async def test_delete_image_group_files(
+    client: AsyncClient,
+    path_image: Path,
+    headers: dict[str, str],
+    monkeypatch: pytest.MonkeyPatch,
+):
+    monkeypatch.setattr(api, "convert_image", celery_app.convert)
+    await client.post("/tags/", json={"name": "pop"})
+    # unique content, so that no file is shared with another upload
+    content = path_image.read_bytes() + uuid4().bytes
+    response = await client.post(
+        "/images/",
+        files={"image": ("group.jpg", content, "image/jpeg")},
+        data={"resolutions": ["40x30"], "tags": [1]},
+        headers=headers,
+    )
+    identifier = response.json()["job_id"]
+    response = await client.get(
+        f"/images/{identifier}/render",
+        params={"w": 20, "h": 15},
+        headers=headers,
+    )
+    assert response.status_code == status.HTTP_200_OK
+    files = [*(config.MEDIA_DIR / identifier).iterdir()]
+    files += [*(config.MEDIA_DIR / "cache").glob(f"{identifier}_*")]
+    assert len(files) == 4  # original, variant, grayscale, render
+    size = sum(file.stat().st_size for file in files)
+    garbage = app.state.garbage
+    reclaimed = garbage.reclaimed
+
+    response = await client.delete(
+        f"/images/group/{identifier}/", headers=headers
+    )
+    assert response.json()["deleted"] == 2
+    for _ in range(100):
+        if garbage.reclaimed - reclaimed == size:
+            break
+        await asyncio.sleep(0.05)
+    assert garbage.reclaimed - reclaimed == size
+    assert not any(file.exists() for file in files)
+    assert not app.state.render_cache.evict(f"{identifier}_")
+
+
+async def test_create_image_too_large(
+    client: AsyncClient,
+    path_image: Path,
+    headers: dict[str, str],
+    monkeypatch: pytest.MonkeyPatch,
+):
+    monkeypatch.setattr(config, "MAX_UPLOAD_SIZE", 1024)
+    data = {"resolutions": ["100x100"], "tags": [1]}
+    with open(path_image, "rb") as file:
+        response = await client.post(
+            "/images/", files={"image": file}, data=data, headers=headers
+        )
+    assert response.status_code == status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+
+
+@pytest.mark.parametrize("resolution", ["20000x20000", "0x100", "100"])
+async def test_create_image_bad_resolution(
+    client: AsyncClient,
+    path_image: Path,
+    headers: dict[str, str],
+    resolution: str,
+):
+    data = {"resolutions": ["100x100", resolution], "tags": [1]}
+    with open(path_image, "rb") as file:
+        response = await client.post(
+            "/images/", files={"image": file}, data=data, headers=headers
+        )
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+async def test_create_image_too_large_stream(
+    client: AsyncClient,
+    headers: dict[str, str],
+    monkeypatch: pytest.MonkeyPatch,
+):
+    monkeypatch.setattr(config, "MAX_UPLOAD_SIZE", 1024)
+    monkeypatch.setattr(config, "MAX_FORM_SIZE", 1024)
+    sent = 0
+
+    async def body() -> AsyncIterator[bytes]:
+        nonlocal sent
+        yield (
+            b"--b\r\nContent-Disposition: form-data; "
+            b'name="image"; filename="big.jpg"\r\n\r\n'
+        )
+        for _ in range(100):
+            sent += 1024
+            yield b"x" * 1024
+
+    response = await client.post(
+        "/images/",
+        content=body(),
+        headers={"Content-Type": "multipart/form-data; boundary=b", **headers},
+    )
+    assert response.status_code == status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    assert sent < 100 * 1024
+
+
+async def test_create_image_queue_full(
+    client: AsyncClient,
+    path_image: Path,
+    headers: dict[str, str],
+    monkeypatch: pytest.MonkeyPatch,
+):
+    monkeypatch.setattr(config, "MAX_PENDING_JOBS", 0)
+    data = {"resolutions": ["100x100"], "tags": [1]}
+    with open(path_image, "rb") as file:
+        response = await client.post(
+            "/images/", files={"image": file}, data=data, headers=headers
+        )
+    assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+    assert response.headers["Retry-After"] == str(config.SHED_RETRY_AFTER)
+
+    # shed before the upload is read
+    sent = 0
+
+    async def body() -> AsyncIterator[bytes]:
+        nonlocal sent
+        for _ in range(10):
+            sent += 1
+            yield b"x" * 1024
+
+    response = await client.post(
+        "/images/batch/",
+        content=body(),
+        headers={"Content-Type": "multipart/form-data; boundary=b", **headers},
+    )
+    assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+    assert sent == 0
+
+
+async def test_create_image_rate_limited(
+    client: AsyncClient,
+    path_image: Path,
+    headers: dict[str, str],
+    monkeypatch: pytest.MonkeyPatch,
+):
+    monkeypatch.setattr(config, "UPLOAD_BURST", 0)
+    monkeypatch.setattr(config, "UPLOAD_RATE", 0.5)
+    data = {"resolutions": ["100x100"], "tags": [1]}
+    with open(path_image, "rb") as file:
+        response = await client.post(
+            "/images/", files={"image": file}, data=data, headers=headers
+        )
+    assert response.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+    assert response.headers["Retry-After"] == "2"
+
+
+async def test_create_image_unsupported_format(
+    client: AsyncClient,
+    path_image: Path,
+    headers: dict[str, str],
+    monkeypatch: pytest.MonkeyPatch,
+):
+    monkeypatch.setattr(encoders, "supported", lambda format_: False)
+    data = {"resolutions": ["100x100"], "tags": [1], "format": "avif"}
+    with open(path_image, "rb") as file:
+        response = await client.post(
+            "/images/", files={"image": file}, data=data, headers=headers
+        )
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+async def test_get_images_page(client: AsyncClient, headers: dict[str, str]):
+    response = await client.get(
+        "/images/", params={"limit": 1}, headers=headers
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert set(response.json()) == {"items", "next_cursor"}
+
+    response = await client.get(
+        "/images/", params={"cursor": "invalid"}, headers=headers
+    )
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+async def test_get_images_pages_same_data(
+    client: AsyncClient, headers: dict[str, str]
+):
+    # newer than every other image, so they come first
+    data = datetime(2100, 1, 1)
+    rows = [
+        {
+            "title": f"same-data-{number}",
+            "file_path": f"same-data-{number}.jpg",
+            "data": data,
+            "resolution": "10x10",
+            "size": 1,
+            "uuid": uuid4(),
+        }
+        for number in range(5)
+    ]
+    async with app.state.async_session() as session:
+        image_ids = await crud.create_images(session, rows, [])
+    try:
+        seen: list[int] = []
+        params: dict[str, Any] = {"limit": 2}
+        while True:
+            response = await client.get(
+                "/images/", params=params, headers=headers
+            )
+            assert response.status_code == status.HTTP_200_OK
+            page = response.json()
+            seen.extend(item["id"] for item in page["items"])
+            if page["next_cursor"] is None:
+                break
+            params["cursor"] = page["next_cursor"]
+        async with app.state.async_session() as session:
+            total = await session.scalar(
+                sa.select(sa.func.count()).select_from(models.Image)
+            )
+        assert len(seen) == len(set(seen)) == total
+        assert seen[:5] == sorted(image_ids, reverse=True)
+    finally:
+        async with app.state.async_session() as session:
+            await session.execute(
+                sa.delete(models.Image).where(models.Image.id.in_(image_ids))
+            )
+            await session.commit()
+
+
+async def test_render_image_not_found(
+    client: AsyncClient, headers: dict[str, str]
+):
+    response = await client.get(
+        f"/images/{uuid4()}/render", params={"w": 100, "h": 100}
+    )
+    assert response.status_code == status.HTTP_403_FORBIDDEN
+
+    response = await client.get(
+        f"/images/{uuid4()}/render",
+        params={"w": 100, "h": 100},
+        headers=headers,
+    )
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+async def test_get_job_not_found(client: AsyncClient, headers: dict[str, str]):
+    response = await client.get(f"/images/jobs/{uuid4()}", headers=headers)
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+async def test_get_job_events_lost_job(
+    client: AsyncClient,
+    path_image: Path,
+    headers: dict[str, str],
+    monkeypatch: pytest.MonkeyPatch,
+):
+    # the conversion is never run, as if its worker was killed
+    monkeypatch.setattr(api, "convert_image", lambda dict_: None)
+    monkeypatch.setattr(config, "PENDING_TTL", 0)
+    data = {"resolutions": ["100x100"], "tags": [1]}
+    with open(path_image, "rb") as file:
+        response = await client.post(
+            "/images/",
+            files={"image": ("lost.jpg", file.read() + b"lost")},
+            data=data,
+            headers=headers,
+        )
+    job_id = response.json()["job_id"]
+
+    response = await client.get(
+        f"/images/jobs/{job_id}/events", headers=headers
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert '"status": "failed"' in response.text
+    response = await client.get(f"/images/jobs/{job_id}", headers=headers)
+    assert response.json()["status"] == "failed"
+
+
+async def test_create_images_batch(
+    client: AsyncClient,
+    path_image: Path,
+    headers: dict[str, str],
+    monkeypatch: pytest.MonkeyPatch,
+):
+    store_image = api.store_image
+
+    async def store_or_fail(image: Any, *args: Any, **kwargs: Any):
+        if image.filename == "broken.jpg":
+            raise RuntimeError("storage is down")
+        return await store_image(image, *args, **kwargs)
+
+    def convert_now(dicts: list[dict[str, Any]]) -> None:
+        for dict_ in dicts:
+            celery_app.convert(dict_)
+
+    monkeypatch.setattr(api, "store_image", store_or_fail)
+    monkeypatch.setattr(api, "convert_batch", convert_now)
+    content = path_image.read_bytes()
+    files = [
+        ("images", (name, content + name.encode()))
+        for name in ("first.jpg", "broken.jpg", "second.jpg")
+    ]
+    data = {"resolutions": ["40x30"], "tags": [1]}
+    response = await client.post(
+        "/images/batch/", files=files, data=data, headers=headers
+    )
+    assert response.status_code == status.HTTP_201_CREATED
+    body = response.json()
+    assert len(body["job_ids"]) == 2
+    assert [failure["file"] for failure in body["failed"]] == ["broken.jpg"]
+
+    response = await client.get(
+        f"/images/batches/{body['batch_id']}", headers=headers
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == {
+        "batch_id": body["batch_id"],
+        "status": "done",
+        "total": 3,
+        "done": 2,
+        "failed": 1,
+    }
+
+
+async def test_get_batch_not_found(
+    client: AsyncClient, headers: dict[str, str]
+):
+    response = await client.get(f"/images/batches/{uuid4()}", headers=headers)
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+async def test_search_images(client: AsyncClient, headers: dict[str, str]):
+    response = await client.get(
+        "/images/search",
+        params={"tags": "1,2", "match": "all"},
+        headers=headers,
+    )
+    assert response.status_code == status.HTTP_200_OK
+
+    response = await client.get(
+        "/images/search", params={"tags": "1;2"}, headers=headers
+    )
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+async def test_metrics(client: AsyncClient):
+    await client.get("/images/result/")
+    response = await client.get("/metrics")
+    assert response.status_code == status.HTTP_200_OK
+    assert 'route="/images/result/"' in response.text
+    assert "db_pool_checked_out" in response.text
+
+
+async def test_current_user_cached(
+    client: AsyncClient,
+    headers: dict[str, str],
+    monkeypatch: pytest.MonkeyPatch,
+):
+    queried = []
+    get_user = dependency.get_user
+
+    async def counted_get_user(session: Any, email: str) -> Any:
+        queried.append(email)
+        return await get_user(session, email)
+
+    monkeypatch.setattr(dependency, "get_user", counted_get_user)
+    for _ in range(2):
+        response = await client.get("/images/", headers=headers)
+        assert response.status_code == status.HTTP_200_OK
+    assert len(queried) == 1
+    email = queried[0]
+    assert await user_cache.get(email) is not None
+
+    async with app.state.async_session() as session:
+        user = await get_user(session, email)
+        assert user is not None
+        data = {"id": user.id, "password": get_password_hash("changed")}
+        await crud.create_or_update_user(
+            session, models.User, data, crud.update_item
+        )
+    assert await user_cache.get(email) is None
+
+    response = await client.get("/images/", headers=headers)
+    assert response.status_code == status.HTTP_200_OK
+    assert queried == [email, email]
+
+
+async def test_tag_catalog(
+    client: AsyncClient,
+    path_image: Path,
+    headers: dict[str, str],
+    monkeypatch: pytest.MonkeyPatch,
+):
+    redis = app.state.redis
+    version = int(await redis.get(tag_catalog.VERSION_KEY) or 0)
+    response = await client.post("/tags/", json={"name": uuid4().hex})
+    tag_id = response.json()["id"]
+    assert int(await redis.get(tag_catalog.VERSION_KEY)) == version + 1
+
+    monkeypatch.setattr(api, "convert_image", celery_app.convert)
+    data = {"resolutions": ["80x60"], "tags": [tag_id]}
+    with open(path_image, "rb") as file:
+        await client.post(
+            "/images/", files={"image": file}, data=data, headers=headers
+        )
+    # names come from the catalog, not from the database
+    monkeypatch.setitem(app.state.tag_catalog.tags, tag_id, "from-catalog")
+    response = await client.get("/images/result/", headers=headers)
+    assert response.json()[0]["tags"] == [
+        {"id": tag_id, "name": "from-catalog"}
+    ]
+
+
+async def test_media_caching(client: AsyncClient):
+    name = f"{uuid4().hex}.jpg"
+    (config.MEDIA_DIR / name).write_bytes(b"0123456789")
+    response = await client.get(f"/media/{name}")
+    assert response.status_code == status.HTTP_200_OK
+    assert "immutable" in response.headers["Cache-Control"]
+    etag = response.headers["ETag"]
+
+    response = await client.get(f"/media/{name}")
+    assert response.headers["ETag"] == etag
+
+    response = await client.get(
+        f"/media/{name}", headers={"If-None-Match": etag}
+    )
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+    for headers in (
+        {"Range": "bytes=2-5"},
+        {"Range": "bytes=2-5", "If-Range": etag},
+    ):
+        response = await client.get(f"/media/{name}", headers=headers)
+        assert response.status_code == status.HTTP_206_PARTIAL_CONTENT
+        assert response.content == b"2345"
+
+    response = await client.get(
+        f"/media/{name}", headers={"Range": "bytes=2-5", "If-Range": '"old"'}
+    )
+    assert response.status_code == status.HTTP_200_OK
@@ -0,0 +1,73 @@
+import pytest
+from celery_app import (
+    GRAYSCALE,
+    LARGE_QUEUE,
+    SMALL_QUEUE,
+    budget_size,
+    decode_size,
+    route,
+)
+from settings import config
+
+
+@pytest.mark.parametrize(
+    ("size", "budget", "expected"),
+    [
+        ((100, 50), 5000, (100, 50)),
+        ((100, 50), 10000, (100, 50)),
+        ((200, 100), 5000, (100, 50)),
+        ((4000, 3000), 3_000_000, (2000, 1500)),
+        ((10000, 1), 100, (1000, 1)),
+        ((1, 10000), 1, (1, 100)),
+    ],
+)
+def test_budget_size(
+    size: tuple[int, int], budget: int, expected: tuple[int, int]
+):
+    assert budget_size(size, budget) == expected
+
+
+def test_budget_size_fits_budget():
+    width, height = budget_size((12345, 6789), 1_000_000)
+    assert width * height <= 1_000_000
+    assert abs(width / height - 12345 / 6789) < 0.01
+
+
+@pytest.mark.parametrize(
+    ("variants", "size", "expected"),
+    [
+        (["100x100", "500x300"], (4000, 3000), (500, 300)),
+        (["100x400", "300x100"], (4000, 3000), (300, 400)),
+        (["100x100", GRAYSCALE], (4000, 3000), (4000, 3000)),
+        ([GRAYSCALE], (800, 600), (800, 600)),
+    ],
+)
+def test_decode_size(
+    variants: list[str], size: tuple[int, int], expected: tuple[int, int]
+):
+    assert decode_size(variants, size) == expected
+
+
+def test_decode_size_grayscale_over_budget(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(config, "IMAGE_PIXEL_BUDGET", 1_000_000)
+    assert decode_size(["100x100", GRAYSCALE], (4000, 1000)) == (2000, 500)
+    assert decode_size(["3000x100", GRAYSCALE], (4000, 1000)) == (3000, 500)
+
+
+@pytest.mark.parametrize(
+    ("cost", "queue", "priority"),
+    [
+        (0, SMALL_QUEUE, 9),
+        (999, SMALL_QUEUE, 9),
+        (1000, LARGE_QUEUE, 8),
+        (1999, LARGE_QUEUE, 8),
+        (2000, LARGE_QUEUE, 7),
+        (9000, LARGE_QUEUE, 0),
+        (10**9, LARGE_QUEUE, 0),
+    ],
+)
+def test_route(
+    monkeypatch: pytest.MonkeyPatch, cost: int, queue: str, priority: int
+):
+    monkeypatch.setattr(config, "CONVERT_LARGE_COST", 1000)
+    assert route(cost) == {"queue": queue, "priority": priority}
@@ -0,0 +1,53 @@
+import fakeredis
+import jobs
+import pytest
+from settings import config
+
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+async def test_overdue_job_fails(monkeypatch: pytest.MonkeyPatch):
+    redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+    await jobs.create_batch(redis, "b", "owner", 2)
+    monkeypatch.setattr(config, "PENDING_TTL", -1)
+    await jobs.create(
+        redis, "lost", "owner", ["10x10"], [], batch_id="b", size=5
+    )
+    monkeypatch.setattr(config, "PENDING_TTL", 60)
+    await jobs.create(
+        redis, "live", "owner", ["10x10"], [], batch_id="b", size=7
+    )
+    async with redis.pubsub() as pubsub:
+        await pubsub.subscribe(jobs.channel("lost"))
+        await pubsub.get_message(timeout=1)
+
+        job = await jobs.get(redis, "lost")
+        assert job is not None and job["status"] == jobs.FAILED
+        message = await pubsub.get_message(timeout=1)
+        assert message is not None and jobs.FAILED in message["data"]
+
+    job = await jobs.get(redis, "live")
+    assert job is not None and job["status"] == jobs.QUEUED
+    assert await jobs.pending(redis) == (1, 7)
+    batch = await jobs.get_batch(redis, "b")
+    assert batch is not None
+    assert (batch["status"], batch["failed"]) == (jobs.RUNNING, 1)
+
+
+async def test_overdue_batch_ends(monkeypatch: pytest.MonkeyPatch):
+    redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+    monkeypatch.setattr(config, "PENDING_TTL", -1)
+    await jobs.create_batch(redis, "b", "owner", 2)
+    for job_id in ("first", "second"):
+        await jobs.create(redis, job_id, "owner", ["10x10"], [], batch_id="b")
+
+    batch = await jobs.get_batch(redis, "b")
+    assert batch is not None
+    assert (batch["status"], batch["failed"]) == (jobs.DONE, 2)
+    assert await jobs.pending(redis) == (0, 0)
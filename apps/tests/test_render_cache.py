@@ -0,0 +1,60 @@
+import asyncio
+from pathlib import Path
+
+import pytest
+from render_cache import RenderCache
+
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+def writer(size: int, calls: list[Path] | None = None):
+    def render(path: Path) -> None:
+        if calls is not None:
+            calls.append(path)
+        path.write_bytes(b"x" * size)
+
+    return render
+
+
+async def test_evicts_least_recently_used(tmp_path: Path):
+    cache = RenderCache(tmp_path, max_bytes=25)
+    for name in ("a", "b"):
+        await cache.get(name, writer(10))
+        cache.release(name)
+    await cache.get("a", writer(10))  # hit, "b" is now the oldest
+    cache.release("a")
+    await cache.get("c", writer(10))
+    cache.release("c")
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["a", "c"]
+    assert cache.size == 20
+
+
+async def test_keeps_files_being_sent(tmp_path: Path):
+    cache = RenderCache(tmp_path, max_bytes=15)
+    path = await cache.get("a", writer(10))
+    await cache.get("b", writer(10))
+    cache.release("b")
+    # over the budget while "a" is pinned
+    assert path.exists()
+    assert cache.size == 20
+
+    cache.release("a")
+    await cache.get("c", writer(10))
+    assert [path.name for path in tmp_path.iterdir()] == ["c"]
+
+
+async def test_coalesces_concurrent_misses(tmp_path: Path):
+    cache = RenderCache(tmp_path, max_bytes=100)
+    calls: list[Path] = []
+    paths = await asyncio.gather(
+        *(cache.get("a", writer(10, calls)) for _ in range(5))
+    )
+    assert len(calls) == 1
+    assert paths == [tmp_path / "a"] * 5
+    assert cache.size == 10
@@ -0,0 +1,54 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator
+
+import fakeredis
+import pytest
+from tag_catalog import TagCatalog
+
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+class FakeResult:
+    def __init__(self, rows: list[tuple[int, str]]):
+        self.rows = rows
+
+    def tuples(self) -> "FakeResult":
+        return self
+
+    def all(self) -> list[tuple[int, str]]:
+        return self.rows
+
+
+class FakeSession:
+    def __init__(self, rows: list[tuple[int, str]]):
+        self.rows = rows
+        self.queries = 0
+
+    async def execute(self, _: Any) -> FakeResult:
+        self.queries += 1
+        await asyncio.sleep(0.01)
+        return FakeResult(self.rows)
+
+    @asynccontextmanager
+    async def __call__(self) -> AsyncIterator["FakeSession"]:
+        yield self
+
+
+async def test_known_reloads_once_for_concurrent_misses():
+    session = FakeSession([(1, "dom"), (2, "maf")])
+    catalog = TagCatalog(
+        session, fakeredis.FakeAsyncRedis()  # type: ignore[arg-type]
+    )
+    results = await asyncio.gather(*(catalog.known([2, 3]) for _ in range(5)))
+    assert results == [[2]] * 5
+    # the others missed while the first reload was running, so they share
+    # one more reload instead of four
+    assert session.queries == 2
+    assert catalog.resolve([1, 3]) == [{"id": 1, "name": "dom"}]
@@ -0,0 +1,64 @@
+"""
+Optional OpenTelemetry. With TRACING on and the opentelemetry-sdk,
+opentelemetry-exporter-otlp, opentelemetry-instrumentation-fastapi and
+opentelemetry-instrumentation-celery packages installed, spans are
+exported over OTLP (configured by the standard OTEL_* variables) and the
+trace context goes from the request to the worker in the Celery message
+headers. Without them everything here is a no-op
+"""
+
+import logging
+from contextlib import AbstractContextManager, nullcontext
+from typing import Any
+
+from settings import config
+
+
+logger = logging.getLogger(__name__)
+
+try:
+    from opentelemetry import trace
+except ImportError:  # pragma: no cover
+    trace = None  # type: ignore[assignment]
+
+
+def setup(service_name: str) -> bool:
+    if not config.TRACING:
+        return False
+    try:
+        # pylint:disable=C0415
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import (
+            OTLPSpanExporter,
+        )
+        from opentelemetry.instrumentation.celery import CeleryInstrumentor
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    except ImportError as err:
+        logger.warning("Tracing is off: %s", err)
+        return False
+    provider = TracerProvider(
+        resource=Resource.create({"service.name": service_name})
+    )
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    trace.set_tracer_provider(provider)
+    CeleryInstrumentor().instrument()
+    return True
+
+
+def instrument_app(app: Any) -> None:
+    if not setup("images-api"):
+        return
+    try:
+        # pylint:disable=C0415
+        from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
+    except ImportError as err:
+        logger.warning("FastAPI tracing is off: %s", err)
+        return
+    FastAPIInstrumentor.instrument_app(app)
+
+
+def span(name: str) -> AbstractContextManager:
+    if trace is None:
+        return nullcontext()
+    return trace.get_tracer(__name__).start_as_current_span(name)
@@ -1,15 +1,67 @@
+import base64
+import hashlib
+import json
 import os
+from datetime import datetime
 from pathlib import Path
-from typing import Any
+from typing import Any, BinaryIO
 from uuid import uuid4
 
+import encoders
+from fastapi import HTTPException, status
+from PIL import Image
 
-def write_file(filename: str, content: bytes, dir_path: Path) -> str:
+
+def check_size(size: int, max_size: int) -> None:
+    if size > max_size:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"File is larger than {max_size} bytes",
+        )
+
+
+def check_format(format_: str) -> None:
+    if not encoders.supported(format_):
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"Format {format_} is not supported",
+        )
+
+
+def write_file(
+    filename: str,
+    source: BinaryIO,
+    dir_path: Path,
+    max_size: int,
+    chunk_size: int,
+) -> tuple[str, str]:
+    """
+    Copy `source` into `dir_path` by chunks of `chunk_size` bytes,
+    so memory usage doesn't depend on the file size. Returns the path
+    and the SHA-256 of the content, hashed in the same pass
+    """
     file_name = Path(filename)
     new_file_name = f"{file_name.stem}{str(uuid4())}{file_name.suffix}"
     file_path = dir_path / new_file_name
-    file_path.write_bytes(content)
-    return str(file_path)
+    digest = hashlib.sha256()
+    size = 0
+    with file_path.open("wb") as file:
+        while chunk := source.read(chunk_size):
+            size += len(chunk)
+            if size > max_size:
+                break
+            digest.update(chunk)
+            file.write(chunk)
+    try:
+        check_size(size, max_size)
+    except HTTPException:
+        file_path.unlink()
+        raise
+    return str(file_path), digest.hexdigest()
+
+
+def variant_title(file_name: str, variant: str) -> str:
+    return f"{file_name}_{variant}"
 
 
 def make_image_data(
@@ -24,3 +76,29 @@ def make_image_data(
         "uuid": uuid,
     }
     return dict_image
+
+
+def image_pixels(path: str) -> int:
+    """
+    From the header only, 0 when it isn't an image Pillow can read
+    """
+    try:
+        with Image.open(path) as image:
+            return image.width * image.height
+    except (OSError, Image.DecompressionBombError):
+        return 0
+
+
+def encode_cursor(data: datetime, item_id: int) -> str:
+    raw = json.dumps([data.isoformat(), item_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        data, item_id = json.loads(base64.urlsafe_b64decode(cursor))
+        return datetime.fromisoformat(data), int(item_id)
+    except (ValueError, TypeError) as err:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor"
+        ) from err